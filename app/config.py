@@ -7,8 +7,23 @@ class Config(object):
     Setting SECRET_KEY to get forms CSRF to work.  Randomly
     generating is probably not a good idea if running
     in production.
+
+    MONGO_* settings configure the application's shared MongoClient
+    (see main/db.py) and can be set in the environment.
     """
     SECRET_KEY = os.urandom(24)
     SESSION_TYPE = "filesystem"
-
-
+    MONGO_HOST = os.environ.get("MONGO_HOST","localhost")
+    MONGO_PORT = int(os.environ.get("MONGO_PORT",27017))
+    MONGO_DB = os.environ.get("MONGO_DB","symptoms_db")
+    MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE",100))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE",0))
+    MONGO_CONNECT_TIMEOUT_MS = int(
+        os.environ.get("MONGO_CONNECT_TIMEOUT_MS",20000)
+    )
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+        os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS",30000)
+    )
+    MONGO_SOCKET_TIMEOUT_MS = int(
+        os.environ.get("MONGO_SOCKET_TIMEOUT_MS",0)
+    ) or None
@@ -1,8 +1,31 @@
 from datetime import datetime
 from . import utils
 import pandas as pd
+import numpy as np
 from collections import Counter
+from itertools import chain,islice
 
+# Symptoms object fields read by df_from_symptoms and
+# pathology_stats_from_symptoms, as mongo projections
+DF_PROJECTION = {
+    "_id": 0,
+    "resource.subject.reference": 1,
+    "resource.gender": 1,
+    "resource.age_begin": 1,
+    "resource.symptoms.text": 1,
+    "resource.symptoms.severity": 1,
+    "resource.pathology": 1
+}
+# Inputs of at least this many symptoms objects are summarized by
+# pathology_stats_from_symptoms with numpy (_pathology_stats_numpy)
+STATS_NUMPY_MIN_OBJS = 5000
+STATS_PROJECTION = {
+    "_id": 0,
+    "resource.gender": 1,
+    "resource.age_begin": 1,
+    "resource.symptoms.text": 1,
+    "resource.symptoms.severity": 1
+}
 
 def _get_encounter_ids(encounters_dict: dict) -> list:
     encounter_ids = list(
@@ -50,9 +73,9 @@ def _get_reasonCodes(encounter_obj: dict) \
 
 def _get_encounter_period(encounter_obj: dict) \
     -> tuple[datetime,datetime]:
-    start = utils.fhir_datetime(
+    start = utils.as_datetime(
         encounter_obj['resource']['period']['start'])
-    end = utils.fhir_datetime(
+    end = utils.as_datetime(
         encounter_obj['resource']['period']['end']
     )
     return start,end
@@ -81,7 +104,7 @@ def _get_condition_code(condition_obj: dict) -> tuple[str,str]:
 
 def _get_root_cause(cond_obj_list: list) -> str:
     cond_obj_list.sort(
-        key = lambda obj: utils.fhir_datetime(
+        key = lambda obj: utils.as_datetime(
             obj['resource']['recordedDate']
         )
     )
@@ -147,7 +170,11 @@ def pathology_stats_from_symptoms(
     symptom_objs: list,
 ) -> dict: 
     """
-    Get basic statistics from a list of symptoms objects.
+    Get basic statistics from a list of symptoms objects.  The
+    objects are read in a single pass, so symptom_objs can be any
+    iterable (e.g. api.iter_pathology_symptoms).  Inputs of at least
+    STATS_NUMPY_MIN_OBJS objects are grouped with numpy, the others
+    with Counters (same result).
 
     Args:
         symptom_objs: (list) list of symptom objects from the 
@@ -156,41 +183,169 @@ def pathology_stats_from_symptoms(
     Returns:
         dict containing symptom, age, and gender frequencies.
     """
+    symptom_objs = iter(symptom_objs)
+    head = list(islice(symptom_objs,STATS_NUMPY_MIN_OBJS))
+    if len(head) >= STATS_NUMPY_MIN_OBJS:
+        return _pathology_stats_numpy(chain(head,symptom_objs))
+    return _pathology_stats_counter(head)
+
+
+def _pathology_stats_counter(symptom_objs: list) -> dict:
+    """
+    pathology_stats_from_symptoms, counting with Counters in a single
+    pass.
+    """
     p_stats = {}
+    age_counter = Counter()
+    gender_counter = Counter()
+    symptom_text_counter = Counter()
+    severity_counters = {}
+    count = 0
+    for s in symptom_objs:
+        count += 1
+        age_counter[int(s['resource']['age_begin'])] += 1
+        gender_counter[s['resource']['gender']] += 1
+        for o in s['resource']['symptoms']:
+            symptom_text_counter[o['text']] += 1
+            severity_counters.setdefault(o['text'],Counter())\
+                [o['severity']] += 1
 
     # Ages
-    ages = [int(s['resource']['age_begin']) for s in symptom_objs]
-    age_counter = Counter(ages)
-    age_counts = age_counter.most_common()
-    age_counts.sort(key=lambda a: a[0])
+    age_counts = sorted(age_counter.items(),key=lambda a: a[0])
     p_stats['age'] = {a[0]:a[1] for a in age_counts}
 
     # Gender
-    genders = [s['resource']['gender'] for s in symptom_objs]
-    gender_counter = Counter(genders)
-    gender_counts = gender_counter.most_common()
-    gender_counts.sort(key=lambda g: g[0])
+    gender_counts = sorted(gender_counter.items(),key=lambda g: g[0])
     p_stats['gender'] = {g[0]:g[1] for g in gender_counts}
 
     # Symptoms
-    symptoms = [o for s in symptom_objs for o in \
-        s['resource']['symptoms']]
-    symptom_text = [o['text'] for o in symptoms]
-    symptom_text_counter = Counter(symptom_text)
     symptom_text_counts = symptom_text_counter.most_common()
     symptom_dict = {}
-    for i,symptom_count in enumerate(symptom_text_counts):
+    for symptom_count in symptom_text_counts:
         symptom_dict[symptom_count[0]] = {'count':symptom_count[1]}
-        severity = [int(o['severity']) for o in symptoms if o['text'] == \
-            symptom_count[0]]
-        severity_counter = Counter(severity)
-        severity_counts = severity_counter.most_common()
-        severity_counts.sort(key = lambda s: s[0])
+        severity_counts = sorted(
+            severity_counters[symptom_count[0]].items(),
+            key = lambda s: s[0]
+        )
         symptom_dict[symptom_count[0]]['severity'] = severity_counts
     
     p_stats['symptoms'] = symptom_dict
 
     # Count
-    p_stats['count'] = len(symptom_objs)
+    p_stats['count'] = count
+
+    return p_stats
+
+
+def _pathology_stats_numpy(symptom_objs: list) -> dict:
+    """
+    pathology_stats_from_symptoms, grouping with numpy.  The fields
+    are read from symptom_objs (any iterable) in a single pass.
+    Symptom texts are factorized in order of first appearance, so a
+    stable sort by count orders them as Counter.most_common does.
+    Severities must be integers.
+    """
+    p_stats = {}
+    ages = []
+    genders = []
+    texts = []
+    severities = []
+    for s in symptom_objs:
+        ages.append(s['resource']['age_begin'])
+        genders.append(s['resource']['gender'])
+        for o in s['resource']['symptoms']:
+            texts.append(o['text'])
+            severities.append(o['severity'])
+    n_objs = len(ages)
+
+    # Ages
+    ages = np.array(ages,dtype=np.int64)
+    age_values,age_counts = np.unique(ages,return_counts=True)
+    p_stats['age'] = dict(zip(age_values.tolist(),age_counts.tolist()))
+
+    # Gender
+    gender_codes,gender_values = pd.factorize(np.array(genders,\
+        dtype=object))
+    gender_counts = np.bincount(gender_codes,minlength=len(gender_values))
+    p_stats['gender'] = dict(sorted(zip(gender_values.tolist(),\
+        gender_counts.tolist())))
+
+    # Symptoms
+    text_codes,text_values = pd.factorize(np.array(texts,dtype=object))
+    severities = np.array(severities,dtype=np.int64)
+    symptom_dict = {}
+    if len(texts) > 0:
+        text_counts = np.bincount(text_codes,minlength=len(text_values))
+        order = np.argsort(-text_counts,kind="stable")
+        # one integer key per (text, severity) pair, sorted by text and
+        # then severity
+        severity_min = severities.min()
+        n_severities = int(severities.max() - severity_min) + 1
+        keys,key_counts = np.unique(
+            text_codes.astype(np.int64) * n_severities + \
+                (severities - severity_min),
+            return_counts = True
+        )
+        key_texts = keys // n_severities
+        key_severities = (keys % n_severities + severity_min).tolist()
+        key_counts = key_counts.tolist()
+        bounds = np.searchsorted(key_texts,np.arange(len(text_values)+1))
+        for t in order:
+            symptom_dict[text_values[t]] = {
+                'count': int(text_counts[t]),
+                'severity': list(zip(
+                    key_severities[bounds[t]:bounds[t+1]],
+                    key_counts[bounds[t]:bounds[t+1]]
+                ))
+            }
+    p_stats['symptoms'] = symptom_dict
+
+    # Count
+    p_stats['count'] = n_objs
+
+    return p_stats
+
+def pathology_stats_from_counts(counts: dict) -> dict:
+    """
+    Get basic statistics from the counts of one pathology in
+    api.pathology_stats_counts, in the form of
+    pathology_stats_from_symptoms.  Symptoms with equal counts are
+    ordered by text.
+
+    Args:
+        counts: (dict) counts of one pathology from
+            api.pathology_stats_counts.
+
+    Returns:
+        dict containing symptom, age, and gender frequencies.
+    """
+    p_stats = {}
+
+    # Ages
+    age_counts = sorted([(int(a),c) for a,c in counts['age'].items()],
+        key=lambda a: a[0])
+    p_stats['age'] = {a[0]:a[1] for a in age_counts}
+
+    # Gender
+    gender_counts = sorted(counts['gender'].items(),key=lambda g: g[0])
+    p_stats['gender'] = {g[0]:g[1] for g in gender_counts}
+
+    # Symptoms
+    symptom_text_counts = sorted(
+        [(t,sum(sev.values())) for t,sev in counts['symptoms'].items()],
+        key = lambda s: (-s[1],s[0])
+    )
+    symptom_dict = {}
+    for symptom_count in symptom_text_counts:
+        symptom_dict[symptom_count[0]] = {'count':symptom_count[1]}
+        symptom_dict[symptom_count[0]]['severity'] = sorted(
+            counts['symptoms'][symptom_count[0]].items(),
+            key = lambda s: s[0]
+        )
+
+    p_stats['symptoms'] = symptom_dict
+
+    # Count
+    p_stats['count'] = counts['count']
 
     return p_stats
@@ -6,6 +6,9 @@ import datetime
 from . import utils
 from collections import Counter
 
+# Documents per cursor batch for the iter_* query functions
+DEFAULT_CURSOR_BATCH_SIZE = 1000
+
 def get_all_symptoms_old(db: pymongo.database.Database) -> list:
     """
     Gets a list of all symptoms from fhir records.
@@ -302,12 +305,8 @@ def get_encounter_conditions(
         {
             "resource.encounter.reference": encounter_url
         }
-    )
+    ).sort("resource.recordedDate",1)
     all_objs = list(condition_cursor)
-    all_objs.sort(
-        key = lambda obj: utils.fhir_datetime(\
-            obj['resource']['recordedDate'])
-    )
 
     return all_objs
 
@@ -328,20 +327,91 @@ def get_andsymptoms_objs(
     Returns:
         list of symptoms objects from mongo db
     """
+    symptoms_objs = list(iter_andsymptoms_objs(
+        db,
+        symptom_list,
+        **kwargs
+    ))
+    return symptoms_objs
+
+def _andsymptoms_query(
+    symptom_list: list,
+    filters: dict
+) -> dict:
     if len(symptom_list) > 0:
         query = {"resource.symptoms.text": {
                 "$all": symptom_list
             }}
     else:
         query = {}
-    for key,value in kwargs.items():
+    for key,value in filters.items():
         if value is not None:
             query[f"resource.{key}"] = value
-    result = db.symptoms.find(
-        query
-    )
-    symptoms_objs = list(result)
-    return symptoms_objs
+    return query
+
+def iter_andsymptoms_objs(
+    db: pymongo.database.Database,
+    symptom_list: list,
+    projection: dict = None,
+    batch_size: int = DEFAULT_CURSOR_BATCH_SIZE,
+    **kwargs
+):
+    """
+    Iterate over the symptoms objects that include all symptoms in
+    symptoms list, fetching them from the server batch_size at a time.
+
+    Args:
+        db: (pymongo.database.Database) Mongo database connection
+        symptoms_list: (list) list of symptoms to search for
+        projection: (dict) projection to pass to mongo query (default
+            None, whole objects)
+        batch_size: (int) number of objects per cursor batch
+        kwargs: (dict-like) other query specifications
+
+    Returns:
+        generator of symptoms objects from mongo db
+    """
+    query = _andsymptoms_query(symptom_list,kwargs)
+    cursor = db.symptoms.find(
+        query,
+        projection
+    ).batch_size(batch_size)
+    with cursor:
+        yield from cursor
+
+def andsymptoms_pathology_counts(
+    db: pymongo.database.Database,
+    symptom_list: list,
+    **kwargs
+) -> tuple[list,int]:
+    """
+    Count, by pathology, the symptoms objects that include all
+    symptoms in symptoms list (the objects get_andsymptoms_objs would
+    return), without fetching them.
+
+    Args:
+        db: (pymongo.database.Database) Mongo database connection
+        symptoms_list: (list) list of symptoms to search for
+        kwargs: (dict-like) other query specifications
+
+    Returns:
+        list of (pathology, count) tuples in descending order of count,
+            and int total count
+    """
+    query = _andsymptoms_query(symptom_list,kwargs)
+    result = db.symptoms.aggregate([
+        {"$match": query},
+        {
+            "$group": {
+                "_id": "$resource.pathology",
+                "count": {"$sum":1}
+            }
+        },
+        {"$sort": {"count": -1}}
+    ])
+    path_counts = [(r['_id'],r['count']) for r in result]
+    total_records = sum([c[1] for c in path_counts])
+    return path_counts,total_records
 
 def get_orsymptoms_objs(
     db: pymongo.database.Database,
@@ -358,6 +428,35 @@ def get_orsymptoms_objs(
     Returns:
         list of symptoms objects from mongo db
     """
+    symptoms_objs = list(iter_orsymptoms_objs(
+        db,
+        symptom_list,
+        **kwargs
+    ))
+    return symptoms_objs
+
+def iter_orsymptoms_objs(
+    db: pymongo.database.Database,
+    symptom_list: list,
+    projection: dict = None,
+    batch_size: int = DEFAULT_CURSOR_BATCH_SIZE,
+    **kwargs
+):
+    """
+    Iterate over the symptoms objects that include any symptom in
+    symptoms list, fetching them from the server batch_size at a time.
+
+    Args:
+        db: (pymongo.database.Database) Mongo database connection
+        symptoms_list: (list) list of symptoms to search for
+        projection: (dict) projection to pass to mongo query (default
+            None, whole objects)
+        batch_size: (int) number of objects per cursor batch
+        kwargs: (dict-like) other query specifications
+
+    Returns:
+        generator of symptoms objects from mongo db
+    """
     if len(symptom_list) > 0:
         query = {"resource.symptoms.text": {
                 "$in": symptom_list
@@ -367,11 +466,12 @@ def get_orsymptoms_objs(
     
     for key,value in kwargs.items():
         query[f"resource.{key}"] = value
-    result = db.symptoms.find(
-        query
-    )
-    symptoms_objs = list(result)
-    return symptoms_objs
+    cursor = db.symptoms.find(
+        query,
+        projection
+    ).batch_size(batch_size)
+    with cursor:
+        yield from cursor
 
 
 def pathology_symptoms(
@@ -390,15 +490,45 @@ def pathology_symptoms(
     Returns:
         list containing allsymptoms objects from mongo db
     """
+    symptoms_objs = list(iter_pathology_symptoms(
+        db,
+        pathology,
+        **kwargs
+    ))
+    return symptoms_objs
+
+def iter_pathology_symptoms(
+    db: pymongo.database.Database,
+    pathology: str,
+    projection: dict = None,
+    batch_size: int = DEFAULT_CURSOR_BATCH_SIZE,
+    **kwargs
+):
+    """
+    Iterate over the instances of a pathology in the symptoms
+    collection, fetching them from the server batch_size at a time.
+
+    Args:
+        db: (pymongo.database.Database) Mongo database connection
+        pathology: (str) The pathology to search
+        projection: (dict) projection to pass to mongo query (default
+            None, whole objects)
+        batch_size: (int) number of objects per cursor batch
+        kwargs: (dict-like) Additional query criteria
+    
+    Returns:
+        generator of symptoms objects from mongo db
+    """
     query = {"resource.pathology": pathology}
     for key,value in kwargs.items():
         query[f"resource.{key}"] = value
     
-    result = db.symptoms.find(
-        query
-    )
-    symptoms_objs = list(result)
-    return symptoms_objs
+    cursor = db.symptoms.find(
+        query,
+        projection
+    ).batch_size(batch_size)
+    with cursor:
+        yield from cursor
 
 
 def symtpom_collection_count(
@@ -495,15 +625,13 @@ def pathology_symptom_severity_counts(
                         "then":{
                             "present":True,
                             "severity": {
-                                "$toInt":{
-                                    "$arrayElemAt":[
-                                        "$resource.symptoms.severity",
-                                        {"$indexOfArray":[
-                                            "$resource.symptoms.text",
-                                            symptom
-                                        ]}
-                                    ]
-                                }
+                                "$arrayElemAt":[
+                                    "$resource.symptoms.severity",
+                                    {"$indexOfArray":[
+                                        "$resource.symptoms.text",
+                                        symptom
+                                    ]}
+                                ]
                             }
                         },
                         "else":{
@@ -528,3 +656,145 @@ def pathology_symptom_severity_counts(
     result_dict = {tuple(r['_id']):r['count'] for r in result}
     return result_dict
 
+
+
+def all_pathology_symptom_severity_counts(
+    db: pymongo.database.Database
+) -> dict:
+    """
+    Gets the counts of pathology_symptom_severity_counts for every
+    symptom with one aggregation (a single scan of the symptoms
+    collection): symptoms records are unwound and grouped by
+    (pathology, symptom, severity), and the counts of records without
+    a symptom are the per-pathology totals minus the counts with it.
+    Each record contributes exactly one unwound document with array
+    index 0 or null (no symptoms), which gives the totals.  The
+    groups are streamed, so the result is not bound by the size
+    limit of a single document.
+
+    Args:
+        db: (pymonbo.database.Database) Mongo database connection.
+
+    Returns:
+        dict of {symptom: dict of (pathology, symptom [bool], severity)
+            counts}
+    """
+    cursor = db.symptoms.aggregate([
+        {
+            "$unwind": {
+                "path": "$resource.symptoms",
+                "includeArrayIndex": "symptom_index",
+                "preserveNullAndEmptyArrays": True
+            }
+        },
+        {
+            "$group": {
+                "_id":{
+                    "pathology": "$resource.pathology",
+                    "symptom": "$resource.symptoms.text",
+                    "severity": "$resource.symptoms.severity"
+                },
+                "count": {"$sum":1},
+                "records": {
+                    "$sum": {
+                        "$cond": [
+                            {"$eq": [
+                                {"$ifNull": ["$symptom_index",0]},
+                                0
+                            ]},
+                            1,
+                            0
+                        ]
+                    }
+                }
+            }
+        }
+    ], allowDiskUse=True, batchSize=DEFAULT_CURSOR_BATCH_SIZE)
+    totals = {}
+    result_dict = {}
+    present_counts = {}
+    for r in cursor:
+        pathology = r['_id']['pathology']
+        symptom = r['_id'].get('symptom')
+        severity = r['_id'].get('severity')
+        totals[pathology] = totals.get(pathology,0) + r['records']
+        if symptom is None:
+            continue
+        result_dict.setdefault(symptom,{})[(pathology,True,severity)] = \
+            r['count']
+        present_counts[(pathology,symptom)] = \
+            present_counts.get((pathology,symptom),0) + r['count']
+    for symptom in result_dict:
+        for pathology in totals:
+            absent = totals[pathology] - \
+                present_counts.get((pathology,symptom),0)
+            if absent > 0:
+                result_dict[symptom][(pathology,False,0)] = absent
+    return result_dict
+
+
+def pathology_stats_counts(
+    db: pymongo.database.Database,
+    pathologies: list
+) -> dict:
+    """
+    Gets the counts behind the stats of each of a list of
+    pathologies: records, records by age and by gender, and symptoms
+    by text and severity.  Two aggregations (records by age and
+    gender, and symptoms by text and severity) are streamed and
+    merged, so that no single result document grows with the data.
+
+    Args:
+        db: (pymonbo.database.Database) Mongo database connection.
+        pathologies: (list) pathologies to count
+
+    Returns:
+        dict of {pathology: {'count': int, 'age': {age: count},
+            'gender': {gender: count}, 'symptoms': {symptom:
+            {severity: count}}}}
+    """
+    match = {"$match": {"resource.pathology": {"$in": list(pathologies)}}}
+    cursor = db.symptoms.aggregate([
+        match,
+        {
+            "$group": {
+                "_id": {
+                    "pathology": "$resource.pathology",
+                    "age": "$resource.age_begin",
+                    "gender": "$resource.gender"
+                },
+                "count": {"$sum":1}
+            }
+        }
+    ], allowDiskUse=True, batchSize=DEFAULT_CURSOR_BATCH_SIZE)
+    result_dict = {}
+    for r in cursor:
+        stats = result_dict.setdefault(r['_id']['pathology'],{
+            'count': 0,
+            'age': {},
+            'gender': {},
+            'symptoms': {}
+        })
+        stats['count'] += r['count']
+        for key in ['age','gender']:
+            value = r['_id'].get(key)
+            stats[key][value] = stats[key].get(value,0) + r['count']
+    cursor = db.symptoms.aggregate([
+        match,
+        {"$unwind": "$resource.symptoms"},
+        {
+            "$group": {
+                "_id": {
+                    "pathology": "$resource.pathology",
+                    "value": "$resource.symptoms.text",
+                    "severity": "$resource.symptoms.severity"
+                },
+                "count": {"$sum":1}
+            }
+        }
+    ], allowDiskUse=True, batchSize=DEFAULT_CURSOR_BATCH_SIZE)
+    for r in cursor:
+        symptoms = result_dict[r['_id']['pathology']]['symptoms']
+        symptoms.setdefault(r['_id']['value'],{})\
+            [r['_id']['severity']] = r['count']
+    return result_dict
@@ -6,6 +6,9 @@ import numpy as np
 from types import MethodType
 from itertools import product
 
+# Cases scored at a time by symptomsFactorGraph.batch_posterior
+BATCH_CHUNK_SIZE = 4096
+
 if __name__ == "__main__":
 
     import os,sys
@@ -78,6 +81,24 @@ class VariableNode(Node):
         self.fixed_value = None
         self.nodeType = "VariableNode"
 
+    def index(
+        self,
+        value: object
+    ) -> int:
+        """
+        Position of value in self.values, which is the position of
+        its entry in messages to or from this node.
+        """
+        # Cached per values; rebuilt when values is replaced or edited
+        # in place.  The comparison is linear in len(values), like the
+        # message the position is used for.
+        key = tuple(self.values)
+        cache = self.__dict__.get("_index_cache")
+        if cache is None or cache[0] != key:
+            cache = (key,{v:i for i,v in enumerate(self.values)})
+            self._index_cache = cache
+        return cache[1][value]
+
     def set_value(
             self,
             value: object
@@ -91,28 +112,24 @@ class VariableNode(Node):
     def message_out(
         self,
         out_node_obj: "FactorNode"
-    ) -> dict:
+    ) -> np.ndarray:
+        """
+        Message to a neighboring factor: the product of the messages
+        from all other neighbors, as a 1-D array indexed like
+        self.values.
+        """
         out_node = out_node_obj.get_name()
         self.check_messages(out_node)
-        if self.leaf:
-            out_message = {
-                v: 1 for v in self.values 
-            }
-        else:
-            out_message = {
-                v: np.prod(
-                    [
-                        self.messages_in[n][v] for n in \
-                            self.messages_in if n != out_node
-                    ]
-                ) for v in self.values
-            }
+        out_message = np.ones(len(self.values))
+        if not self.leaf:
+            for n in self.messages_in:
+                if n != out_node:
+                    out_message = out_message * self.messages_in[n]
         
         if self.fixed_value is not None:
-            out_message = {
-                v: out_message[v] if v == self.fixed_value else 0 \
-                    for v in self.values
-            }
+            mask = np.zeros(len(self.values))
+            mask[self.index(self.fixed_value)] = 1
+            out_message = out_message * mask
         return out_message
     
     def compute_marginals(self):
@@ -121,11 +138,10 @@ class VariableNode(Node):
                 "all messages have been received at node "\
                 f"{self.get_name()}")
         else:
-            self.marginals = {
-                v: np.product([self.messages_in[n][v] for \
-                    n in self.messages_in]) \
-                    for v in self.values
-            }
+            p = np.ones(len(self.values))
+            for n in self.messages_in:
+                p = p * self.messages_in[n]
+            self.marginals = dict(zip(self.values,p.tolist()))
         
     
 class FactorNode(Node):
@@ -140,6 +156,7 @@ class FactorNode(Node):
         super().__init__(name,leaf)
         self.function_args = function_args
         self.function_dict = function_dict
+        self.domains = {}
         self.nodeType = "FactorNode"
 
     def F(
@@ -160,38 +177,98 @@ class FactorNode(Node):
 
         return self.function_dict.get(args) or 0
 
+    def set_domain(
+        self,
+        node: VariableNode
+    ) -> None:
+        """
+        Record the values of a neighboring variable node, which index
+        the corresponding axis of the factor tensor.
+        """
+        self.domains[node.get_name()] = node.values
+        self.__dict__.pop("_table",None)
+        self.__dict__.pop("_barren",None)
+
+    def _axis_positions(self) -> list:
+        missing = [a for a in self.function_args if a not in \
+            self.domains]
+        if len(missing) > 0:
+            raise RuntimeError(f"Factor {self.get_name()} has no "\
+                f"values for {missing}")
+        return [
+            {v:i for i,v in enumerate(self.domains[a])} \
+                for a in self.function_args
+        ]
+
+    def table(self) -> np.ndarray:
+        """
+        The factor function as a dense array with one axis per item of
+        self.function_args, indexed by value position (see
+        VariableNode.index).  Built from self.function_dict on first
+        use.
+
+        Returns:
+            numpy.ndarray of factor function evaluations
+        """
+        table = self.__dict__.get("_table")
+        if table is None:
+            positions = self._axis_positions()
+            table = np.zeros([len(p) for p in positions])
+            for args,value in self.function_dict.items():
+                try:
+                    index = tuple(p[a] for p,a in zip(positions,args))
+                except KeyError:
+                    continue
+                table[index] = value
+            self._table = table
+        return table
+
+    def barren_message(
+        self,
+        out_node_obj: VariableNode
+    ) -> np.ndarray:
+        """
+        Message to a neighboring variable when every other neighbor is
+        an unobserved leaf, i.e. the factor function summed over the
+        other variables.  It does not depend on evidence, so it is
+        computed once (from self.function_dict, without building the
+        factor tensor) and cached.
+
+        Args:
+            out_node_obj: (VariableNode) node to send the message to.
+
+        Returns:
+            numpy.ndarray indexed like out_node_obj.values
+        """
+        out_node = out_node_obj.get_name()
+        barren = self.__dict__.setdefault("_barren",{})
+        if out_node not in barren:
+            positions = self._axis_positions()
+            i = self.function_args.index(out_node)
+            message = np.zeros(len(positions[i]))
+            for args,value in self.function_dict.items():
+                if all([a in p for p,a in zip(positions,args)]):
+                    message[positions[i][args[i]]] += value
+            barren[out_node] = message
+        return barren[out_node]
+
     def message_out(
         self,
         out_node_obj: VariableNode,
-    ) -> dict:
+    ) -> np.ndarray:
+        """
+        Message to a neighboring variable: the factor tensor
+        contracted with the messages from all other neighbors, as a
+        1-D array indexed like out_node_obj.values.
+        """
         out_node = out_node_obj.get_name()
         self.check_messages(out_node)
-        if self.leaf:
-            out_message = {
-                v: self.F(v) for v in \
-                    out_node_obj.values
-            }
-        else:
-            args_list = [(n,list(self.messages_in[n].keys())) \
-                for n in self.messages_in if n != out_node]
-            order = {key:i for i,key in enumerate(self.function_args)}
-            args_list.sort(key = lambda z: order[z[0]])
-            i = self.function_args.index(out_node)
-            out_message = {}
-            for v in out_node_obj.values:
-                args_list_v = \
-                    [al[1] for al in args_list[:i]] + \
-                    [[v]] + \
-                    [al[1] for al in args_list[i:]]
-                
-                args = product(*args_list_v)
-                out_message[v] = sum([self.F(*a) * \
-                    np.product([
-                        self.messages_in[n][a[order[n]]] for n in \
-                            self.messages_in if n != out_node
-                    ]) for a in args
-                ])
-        return out_message
+        operands = [self.table(),list(range(len(self.function_args)))]
+        if not self.leaf:
+            for i,n in enumerate(self.function_args):
+                if n != out_node:
+                    operands += [self.messages_in[n],[i]]
+        return np.einsum(*operands,[self.function_args.index(out_node)])
 
     def compute_marginals(self):
         if len(self.messages_in) != len(self.neighbors):
@@ -199,15 +276,14 @@ class FactorNode(Node):
                 "all messages have been received at node "\
                 f"{self.get_name()}")
         else:
-            args_list = [list(self.messages_in[n].keys()) \
-                for n in self.function_args]
-            args = product(*args_list)
-            self.marginals = {
-                a: self.F(*a)*np.product([
-                    self.messages_in[self.function_args[i]][a[i]] \
-                        for i in range(len(a))
-                ]) for a in args
-            }
+            axes = list(range(len(self.function_args)))
+            operands = [self.table(),axes]
+            for i,n in enumerate(self.function_args):
+                operands += [self.messages_in[n],[i]]
+            p = np.einsum(*operands,axes)
+            args = product(*[self.domains[n] for n in \
+                self.function_args])
+            self.marginals = dict(zip(args,p.ravel().tolist()))
 
     def marginal_pmf(self,*v):
         p = self.marginals.get(v) or 0
@@ -232,6 +308,22 @@ class symptomsFactorGraph(object):
             None
         """
         self.Nodes = {}
+        self.pruned = []
+        self.posterior_arrays = None
+        self.schedules = {}
+        self.evidence_snapshot = None
+
+    def __setstate__(self,state):
+        # Factor domains are recorded by add_link; graphs pickled
+        # before factors kept them get them from their neighbors.
+        self.__dict__.update(state)
+        for node in self.Nodes.values():
+            if isinstance(node,FactorNode):
+                if getattr(node,"domains",None) is None:
+                    node.domains = {}
+                for n in node.neighbors:
+                    if n not in node.domains:
+                        node.set_domain(self.Nodes[n])
         
 
     def _age_variable(self) -> VariableNode:
@@ -283,15 +375,19 @@ class symptomsFactorGraph(object):
 
     def _pathology_symptom_severity_factor(
         self,
-        symptom: str
+        symptom: str,
+        pss_counts: dict = None
     ) -> FactorNode:
         """
         This factor function is the joint distribution
-        symptom and severity conditioned on pathology
+        symptom and severity conditioned on pathology.  pss_counts
+        (the symptom's entry of api.all_pathology_symptom_severity_counts)
+        is queried if not given.
         """
-        with symptoms_db() as db:
-            pss_counts = api.pathology_symptom_severity_counts(db,\
-                symptom)
+        if pss_counts is None:
+            with symptoms_db() as db:
+                pss_counts = api.pathology_symptom_severity_counts(db,\
+                    symptom)
         
         pss_keys = list(pss_counts.keys())
         pathologies = list(set([pss_key[0] for pss_key in pss_keys]))
@@ -327,14 +423,22 @@ class symptomsFactorGraph(object):
 
     def _severity_variable(
         self,
-        symptom: str
+        symptom: str,
+        pss_counts: dict = None
     ) -> VariableNode:
-        with symptoms_db() as db:
-            values = db.symptoms.distinct(
-                "resource.symptoms.severity",
-                {"resource.symptoms.text":symptom}
-            )
-        values = [int(i) for i in values]
+        """
+        The severity domain is the symptom's severities in pss_counts
+        (see _pathology_symptom_severity_factor), or the severities of
+        records with the symptom if not given, plus 0.
+        """
+        if pss_counts is None:
+            with symptoms_db() as db:
+                values = db.symptoms.distinct(
+                    "resource.symptoms.severity",
+                    {"resource.symptoms.text":symptom}
+                )
+        else:
+            values = sorted(set([k[2] for k in pss_counts]))
         if 0 not in values:
             values = [0] + values
         severity_var = VariableNode(
@@ -361,6 +465,11 @@ class symptomsFactorGraph(object):
         """
         Node1.add_link(Node2.get_name())
         Node2.add_link(Node1.get_name())
+        self.schedules = {}
+        for factor,variable in ((Node1,Node2),(Node2,Node1)):
+            if isinstance(factor,FactorNode) and \
+                isinstance(variable,VariableNode):
+                factor.set_domain(variable)
 
     def add_node(
         self,
@@ -376,6 +485,7 @@ class symptomsFactorGraph(object):
             None
         """
         self.Nodes[node.get_name()] = node
+        self.schedules = {}
 
     def build(self) -> None:
         """
@@ -399,11 +509,14 @@ class symptomsFactorGraph(object):
         self.add_node(agp_factor)
         with symptoms_db() as db:
             symptoms = api.get_all_symptoms(db)
+            all_pss_counts = api.all_pathology_symptom_severity_counts(db)
         for symptom in symptoms:
+            pss_counts = all_pss_counts.get(symptom,{})
             symptom_node = self._symptom_variable(symptom)
-            severity_node = self._severity_variable(symptom)
+            severity_node = self._severity_variable(symptom,pss_counts)
             factor_node = self._pathology_symptom_severity_factor(
-                symptom
+                symptom,
+                pss_counts
             )
             self.add_link(pathology,factor_node)
             self.add_link(severity_node,factor_node)
@@ -412,80 +525,521 @@ class symptomsFactorGraph(object):
             self.add_node(severity_node)
             self.add_node(factor_node)
         self.add_node(pathology)
+        self.compile_posterior()
+
+    def compile_schedule(
+        self,
+        root_node: str = "Pathology"
+    ) -> dict:
+        """
+        Work out the order of the sum product messages for root_node
+        once; it only depends on the graph's links.
+
+        Factors whose other neighbors are all leaf variables, apart from
+        one non-leaf variable (the hub), form branches: their messages
+        only depend on those leaves, and on the rest of the graph
+        through the hub (see sum_product's prune).  The rest of the
+        graph is the core, whose messages are ordered by a breadth
+        first search from root_node.
+
+        Args:
+            root_node: (str) Name of the root node.
+
+        Returns:
+            dict with node "names" and "nodes" (indexed by position),
+                "branches" as (factor, hub, [leaves]) positions, "up"
+                and "down" core edges as (from, to) positions in
+                message order, each node's "parent" position (None
+                for the root), and the depth first numbering "first"
+                and "after" that gives each node's subtree
+        """
+        names = list(self.Nodes.keys())
+        index = {n:i for i,n in enumerate(names)}
+        nodes = [self.Nodes[n] for n in names]
+        root = index[root_node]
+
+        branches = []
+        in_branch = set()
+        for i,node in enumerate(nodes):
+            if (not isinstance(node,FactorNode)) or i == root:
+                continue
+            neighbors = [index[n] for n in node.neighbors]
+            leaves = [j for j in neighbors if nodes[j].leaf and \
+                len(nodes[j].neighbors) == 1 and j != root]
+            hubs = [j for j in neighbors if not nodes[j].leaf]
+            if len(hubs) == 1 and len(leaves) + 1 == len(neighbors):
+                branches.append((i,hubs[0],leaves))
+                in_branch.update([i] + leaves)
+
+        parent = {root: None}
+        order = [root]
+        k = 0
+        while k < len(order):
+            i = order[k]
+            k += 1
+            for n in nodes[i].neighbors:
+                j = index[n]
+                if j in in_branch or j == parent[i]:
+                    continue
+                if j in parent:
+                    raise RuntimeError("Cannot sum product; the factor "\
+                        "graph has a cycle.")
+                parent[j] = i
+                order.append(j)
+
+        not_reached = [names[i] for i in range(len(names)) if \
+            i not in parent and i not in in_branch] + \
+            [names[f] for f,hub,leaves in branches if hub not in parent]
+        if len(not_reached) > 0:
+            print(not_reached)
+            raise RuntimeError("Sum Product cannot reach all nodes "\
+                f"from {root_node}.")
+
+        # Number the whole tree depth first, so that the subtree under each
+        # node (the nodes on the far side of its link to its parent)
+        # is the range first[i] <= first[j] < after[i].
+        children = {i: [] for i in range(len(names))}
+        for i in order[1:]:
+            children[parent[i]].append(i)
+        for f,hub,leaves in branches:
+            children[hub].append(f)
+            children[f] = list(leaves)
+            parent[f] = hub
+            parent.update({l: f for l in leaves})
+        first = [0] * len(names)
+        after = [0] * len(names)
+        count = 0
+        stack = [(root,False)]
+        while len(stack) > 0:
+            i,done = stack.pop()
+            if done:
+                after[i] = count
+                continue
+            first[i] = count
+            count += 1
+            stack.append((i,True))
+            stack.extend([(j,False) for j in children[i]])
+
+        return {
+            "names": names,
+            "nodes": nodes,
+            "branches": branches,
+            "up": [(i,parent[i]) for i in reversed(order) if \
+                parent[i] is not None],
+            "down": [(parent[i],i) for i in order if \
+                parent[i] is not None],
+            "parent": [parent[i] for i in range(len(names))],
+            "first": first,
+            "after": after
+        }
+
+    def _schedule(
+        self,
+        root_node: str
+    ) -> dict:
+        schedules = self.__dict__.setdefault("schedules",{})
+        if root_node not in schedules:
+            schedules[root_node] = self.compile_schedule(root_node)
+        return schedules[root_node]
+
+    def _branch_hub(
+        self,
+        factor_name: str
+    ) -> str:
+        return [n for n in self.Nodes[factor_name].neighbors if not \
+            self.Nodes[n].leaf][0]
 
     def sum_product(
         self,
-        root_node: str ="Pathology"
+        root_node: str ="Pathology",
+        prune: bool = False
     ) -> None:
         """ 
         Run the sum product algorithm and updates marginals in all
-        Nodes.
+        Nodes, following the message order from compile_schedule
+        (compiled on first use for each root node).
+
+        The node values used are kept.  When sum_product runs again
+        with the same root_node and prune, only the messages that
+        depend on node values that changed since are recomputed, and
+        nothing is done if none did.  Clearing messages (see clear)
+        forces a full run.
 
         Args: 
             root_node: (str) Name of the root node in the algorithm.
                 Defaults to "Pathology"
+            prune: (bool) If True, branches (see compile_schedule) with
+                no evidence on their leaves only send their cached
+                message (see FactorNode.barren_message) to the hub; no
+                messages are computed inside them.  Their names are
+                kept in self.pruned, and expand_branch completes one
+                when its marginals are needed.  Defaults to False.
         
         Returns:
             None
         """
-        self.clear(values = False)
         if root_node not in self.Nodes:
             raise ValueError(f"Cannot sum product; {root_node} not "\
                 "in factor graph nodes.")
+        schedule = self._schedule(root_node)
+        names = schedule['names']
+        nodes = schedule['nodes']
+        first = schedule['first']
+        after = schedule['after']
+
+        # A message from i to j depends on the evidence in the subtree
+        # on i's side of the link; only messages whose side has
+        # evidence that changed since the last run are recomputed.
+        values = [getattr(n,"fixed_value",None) for n in nodes]
+        snapshot = getattr(self,"evidence_snapshot",None)
+        if snapshot is not None and snapshot['schedule'] is schedule \
+            and snapshot['prune'] == prune:
+            changed = [first[i] for i,v in enumerate(values) if \
+                v != snapshot['values'][i]]
+            if len(changed) == 0:
+                return
+            self.clear(messages = False, values = False)
+        else:
+            changed = None
+            self.clear(values = False)
+        self.pruned = []
+
+        def update(i,j):
+            if names[i] in nodes[j].messages_in and changed is not None:
+                if j == schedule['parent'][i]:
+                    dirty = any([first[i] <= c < after[i] for c in \
+                        changed])
+                else:
+                    dirty = any([not (first[j] <= c < after[j]) for c in \
+                        changed])
+                if not dirty:
+                    return
+            nodes[j].messages_in[names[i]] = nodes[i].message_out(nodes[j])
+
+        expanded = []
+        for f,hub,leaves in schedule['branches']:
+            if prune and all([values[l] is None for l in leaves]):
+                nodes[hub].messages_in[names[f]] = \
+                    nodes[f].barren_message(nodes[hub])
+                nodes[f].messages_in = {}
+                for l in leaves:
+                    nodes[l].messages_in = {}
+                self.pruned.append(names[f])
+                continue
+            for l in leaves:
+                update(l,f)
+            update(f,hub)
+            expanded.append((f,hub,leaves))
+
+        for i,j in schedule['up'] + schedule['down']:
+            update(i,j)
+
+        for f,hub,leaves in expanded:
+            update(hub,f)
+            for l in leaves:
+                update(f,l)
+
+        self.evidence_snapshot = {
+            "schedule": schedule,
+            "prune": prune,
+            "values": values
+        }
+
+    def expand_branch(
+        self,
+        factor_name: str
+    ) -> None:
+        """
+        Compute the messages inside a branch skipped by
+        sum_product(prune = True), so that the factor and its leaf
+        variables can compute marginals.  Does nothing if the branch
+        was not pruned.
 
-        ready = [n for n in self.Nodes if self.Nodes[n].leaf]
-        not_ready = [n for n in self.Nodes if \
-            (not self.Nodes[n].leaf) and n != root_node]
-        while len(ready) > 0:
-            node_name = ready.pop()
-            new_node_list = [n for n in self.Nodes[node_name].\
-                neighbors if n not in self.Nodes[node_name].\
-                    messages_in]
-            if len(new_node_list) != 1:
-                raise RuntimeError("Node in ready list is not ready")
-            new_node_name = new_node_list[0]
-            msg = self.Nodes[node_name].message_out(
-                self.Nodes[new_node_name]
+        Args:
+            factor_name: (str) Name of the branch's factor node,
+                e.g. "PSS_Cough".
+
+        Returns:
+            None
+        """
+        if factor_name not in getattr(self,"pruned",[]):
+            return
+        factor = self.Nodes[factor_name]
+        hub = self._branch_hub(factor_name)
+        leaves = [n for n in factor.neighbors if n != hub]
+        for n in leaves:
+            factor.messages_in[n] = self.Nodes[n].message_out(factor)
+        factor.messages_in[hub] = self.Nodes[hub].message_out(factor)
+        for n in leaves:
+            self.Nodes[n].messages_in[factor_name] = \
+                factor.message_out(self.Nodes[n])
+        self.pruned.remove(factor_name)
+
+    def _factor_array(
+        self,
+        factor_name: str,
+        args: list
+    ) -> np.ndarray:
+        factor = self.Nodes[factor_name]
+        return np.transpose(
+            factor.table(),
+            [factor.function_args.index(a) for a in args]
+        )
+
+    def _value_position(
+        self,
+        node_name: str,
+        value: object
+    ) -> int:
+        node = self.Nodes[node_name]
+        if value not in node.values:
+            raise ValueError(f"Bad value ({value}) for {node_name}")
+        return node.index(value)
+
+    def compile_posterior(self) -> None:
+        """
+        Precompute the arrays used by posterior and batch_posterior:
+        the AGP factor as an (age, gender, pathology) array, and for
+        every symptom the probabilities that it is present and absent
+        given each pathology.  Called
+        by build; graphs without the arrays compile them on first use
+        of posterior.
+
+        Args: (None)
+
+        Returns:
+            None
+        """
+        symptoms = [n[4:] for n in self.Nodes if n[0:4] == "PSS_"]
+        likelihood = np.zeros((
+            len(symptoms),
+            len(self.Nodes['Pathology'].values)
+        ))
+        absent_likelihood = np.zeros(likelihood.shape)
+        for i,symptom in enumerate(symptoms):
+            pss = self._factor_array(
+                f"PSS_{symptom}",
+                ['Pathology',symptom,f"{symptom}_severity"]
             )
-            self.Nodes[new_node_name].messages_in[node_name] = msg
-            if (new_node_name in not_ready) and \
-                ((len(self.Nodes[new_node_name].messages_in) + 1) == \
-                    len(self.Nodes[new_node_name].neighbors)): 
-                ready.append(new_node_name)
-                not_ready.remove(new_node_name)
-        
-        if len(not_ready) > 0:
-            print(not_ready)
-            raise RuntimeError("Sum Product terminated before all "\
-                "nodes have been reached.")
-        
-        if len(self.Nodes[root_node].messages_in) != len(self.\
-            Nodes[root_node].neighbors):
-            raise RuntimeError("Sum Product terminated without "\
-                "all messages reaching the root node")
-        
-        not_ready = [n for n in self.Nodes if n != root_node]
-        ready = [root_node]
-        while len(ready) > 0:
-            current_node = ready.pop()
-            for neighbor in self.Nodes[current_node].neighbors:
-                if current_node not in self.Nodes[neighbor].\
-                    messages_in:
-                    msg = self.Nodes[current_node].\
-                        message_out(self.Nodes[neighbor])
-                    self.Nodes[neighbor].messages_in[current_node] = \
-                        msg
-                    if not self.Nodes[neighbor].leaf:
-                        ready.append(neighbor)
-
-        check = [len(self.Nodes[n].neighbors) - \
-            len(self.Nodes[n].messages_in) for n in self.Nodes]
-
-        try:
-            assert all([c == 0 for c in check])
-        except AssertionError as e:
-            raise RuntimeError("Sum Product Terminated before "\
-                "all nodes were messaged.")
+            likelihood[i] = pss[:,self.Nodes[symptom].index(True),:].\
+                sum(axis=1)
+            absent_likelihood[i] = pss[:,self.Nodes[symptom].\
+                index(False),:].sum(axis=1)
+        self.posterior_arrays = {
+            "prior": self._factor_array(
+                "AGP",
+                ['Age','Gender','Pathology']
+            ),
+            "symptoms": {s:i for i,s in enumerate(symptoms)},
+            "likelihood": likelihood,
+            "absent_likelihood": absent_likelihood
+        }
+
+    def _posterior_arrays(self) -> dict:
+        arrays = getattr(self,"posterior_arrays",None)
+        if arrays is None or "absent_likelihood" not in arrays:
+            self.compile_posterior()
+        return self.posterior_arrays
+
+    def posterior(
+        self,
+        age: int = None,
+        gender: str = None,
+        symptoms: list = [],
+        severities: dict = {}
+    ) -> dict:
+        """
+        Pathology posterior pmf given age, gender, and present
+        symptoms.  The graph is a star around Pathology, so this is
+        the AGP slice for (age, gender) times each symptom's likelihood
+        vector, which is what sum_product gives for the same evidence
+        without passing any messages.  Node values and messages are
+        not used or changed.
+
+        Args:
+            age: (int) patient age (default None, unknown)
+            gender: (str) patient gender (default None, unknown)
+            symptoms: (list) names of present symptoms
+            severities: (dict) {symptom: severity} for symptoms whose
+                severity is known
+
+        Returns:
+            dict of {pathology: probability}; all probabilities are 0
+                if the evidence is impossible
+        """
+        arrays = self._posterior_arrays()
+        prior = arrays['prior']
+        if age is not None:
+            prior = prior[[self._value_position("Age",int(age))]]
+        if gender is not None:
+            prior = prior[:,[self._value_position("Gender",gender)]]
+        p = prior.sum(axis=(0,1))
+        for symptom in set(symptoms) | set(severities):
+            if symptom not in arrays['symptoms']:
+                raise ValueError(f"Unknown symptom {symptom}")
+            if symptom in severities:
+                pss = self._factor_array(
+                    f"PSS_{symptom}",
+                    ['Pathology',symptom,f"{symptom}_severity"]
+                )
+                pss = pss[:,:,self._value_position(f"{symptom}_severity",\
+                    int(severities[symptom]))]
+                if symptom in symptoms:
+                    p = p * pss[:,self.Nodes[symptom].index(True)]
+                else:
+                    p = p * pss.sum(axis=1)
+            else:
+                p = p * arrays['likelihood'][arrays['symptoms'][symptom]]
+        total = p.sum()
+        if total > 0:
+            p = p / total
+        return dict(zip(self.Nodes['Pathology'].values,p.tolist()))
+
+    def _value_positions(
+        self,
+        node_name: str,
+        values: np.ndarray
+    ) -> np.ndarray:
+        """
+        Positions (see VariableNode.index) of an array of values of a
+        node; missing values (None or NaN) get -1.
+        """
+        known = np.array([
+            (v is not None) and (v == v) and (v != "") for v in values
+        ],dtype=bool)
+        positions = np.full(len(values),-1)
+        if known.any():
+            unique,inverse = np.unique(
+                np.asarray(values,dtype=object)[known].astype(
+                    type(self.Nodes[node_name].values[0])),
+                return_inverse = True
+            )
+            positions[known] = np.array([
+                self._value_position(node_name,v.item() if \
+                    hasattr(v,"item") else v) for v in unique
+            ])[inverse]
+        return positions
+
+    def batch_posterior(
+        self,
+        ages: list,
+        genders: list,
+        evidence: np.ndarray,
+        symptoms: list = None,
+        severities: np.ndarray = None,
+        chunk_size: int = BATCH_CHUNK_SIZE
+    ) -> np.ndarray:
+        """
+        Pathology posteriors for many cases at once (see posterior).
+        Likelihoods are combined in log space with matrix products,
+        chunk_size cases at a time.
+
+        Args:
+            ages: (list) patient age of each case; None or NaN if
+                unknown
+            genders: (list) patient gender of each case; None if
+                unknown
+            evidence: (numpy.ndarray) cases x symptoms matrix; 1 if the
+                symptom is present, -1 if it is absent, 0 if unknown
+            symptoms: (list) symptom of each column of evidence
+                (default None, every symptom of the graph in the order
+                of posterior_arrays['symptoms'])
+            severities: (numpy.ndarray) cases x symptoms matrix of
+                known severities, NaN if unknown (default None)
+            chunk_size: (int) cases per chunk
+
+        Returns:
+            numpy.ndarray (cases x pathologies, columns ordered as
+                Nodes['Pathology'].values) of posterior probabilities;
+                rows are 0 where the evidence is impossible
+        """
+        arrays = self._posterior_arrays()
+        if symptoms is None:
+            symptoms = sorted(arrays['symptoms'],\
+                key = lambda s: arrays['symptoms'][s])
+        unknown = [s for s in symptoms if s not in arrays['symptoms']]
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown symptoms {unknown}")
+        evidence = np.asarray(evidence)
+        if evidence.shape[1] != len(symptoms):
+            raise ValueError("evidence needs one column per symptom")
+        if severities is not None:
+            severities = np.asarray(severities,dtype=float)
+
+        rows = [arrays['symptoms'][s] for s in symptoms]
+        prior = arrays['prior']
+        priors = [
+            prior,
+            prior.sum(axis=1),
+            prior.sum(axis=0),
+            prior.sum(axis=(0,1))
+        ]
+        with np.errstate(divide="ignore"):
+            log_likelihood = [
+                np.log(arrays[key][rows]) for key in \
+                    ["likelihood","absent_likelihood"]
+            ]
+        zero_likelihood = [np.isneginf(l).astype(float) for l in \
+            log_likelihood]
+        log_likelihood = [np.where(np.isneginf(l),0,l) for l in \
+            log_likelihood]
+
+        age_positions = self._value_positions("Age",list(ages))
+        gender_positions = self._value_positions("Gender",list(genders))
+        n_cases = evidence.shape[0]
+        result = np.zeros((n_cases,prior.shape[2]))
+        for start in range(0,n_cases,chunk_size):
+            chunk = slice(start,min(start + chunk_size,n_cases))
+            a = age_positions[chunk]
+            g = gender_positions[chunk]
+            p = np.zeros((len(a),prior.shape[2]))
+            for i,(a_known,g_known) in enumerate(product(\
+                [True,False],[True,False])):
+                mask = ((a >= 0) == a_known) & ((g >= 0) == g_known)
+                index = tuple(x[mask] for x,known in ((a,a_known),\
+                    (g,g_known)) if known)
+                p[mask] = priors[i][index] if len(index) > 0 else \
+                    priors[i]
+            with np.errstate(divide="ignore"):
+                log_p = np.log(p)
+            e = evidence[chunk]
+            n_zero = np.zeros(log_p.shape)
+            if severities is not None:
+                sev = severities[chunk]
+                known_sev = ~np.isnan(sev)
+            for j,ev in enumerate([e > 0,e < 0]):
+                ev = ev.astype(float)
+                if severities is not None:
+                    ev[known_sev] = 0
+                log_p += ev @ log_likelihood[j]
+                n_zero += ev @ zero_likelihood[j]
+            if severities is not None:
+                for j in np.flatnonzero(known_sev.any(axis=0)):
+                    symptom = symptoms[j]
+                    cases = np.flatnonzero(known_sev[:,j])
+                    pss = self._factor_array(
+                        f"PSS_{symptom}",
+                        ['Pathology',symptom,f"{symptom}_severity"]
+                    )
+                    pss = np.stack([
+                        pss[:,self.Nodes[symptom].index(True),:],
+                        pss[:,self.Nodes[symptom].index(False),:],
+                        pss.sum(axis=1)
+                    ])
+                    k = np.where(e[cases,j] > 0,0,\
+                        np.where(e[cases,j] < 0,1,2))
+                    sev_positions = self._value_positions(
+                        f"{symptom}_severity",
+                        list(sev[cases,j])
+                    )
+                    with np.errstate(divide="ignore"):
+                        log_p[cases] += np.log(pss[k,:,sev_positions])
+            log_p[n_zero > 0] = -np.inf
+            log_max = log_p.max(axis=1,keepdims=True)
+            possible = np.isfinite(log_max[:,0])
+            q = np.exp(log_p[possible] - log_max[possible])
+            result[chunk][possible] = q / q.sum(axis=1,keepdims=True)
+        return result
 
     def set_gender(self,gender: str) -> None:
         self.Nodes['Gender'].set_value(gender)
@@ -533,6 +1087,9 @@ class symptomsFactorGraph(object):
         Returns:
             None
         """
+        if messages:
+            self.pruned = []
+            self.evidence_snapshot = None
         for n in self.Nodes:
             if messages:
                 self.Nodes[n].messages_in = {}
@@ -1,36 +1,99 @@
+import os
+import threading
 import pymongo
 from contextlib import contextmanager
 
+try:
+    from .. import config
+except ImportError:
+    # main imported as a top level package (PYTHONPATH=app)
+    import config
+
+
+## One MongoClient per process, shared by every request and by the
+## factor graph builder.  pymongo clients are thread-safe and pool
+## their connections, but are not fork-safe, so a forked child (e.g.
+## a pre-forking server's worker) builds its own on first use.
+
+_client = None
+_client_lock = threading.Lock()
+
+def _reset_after_fork():
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+if hasattr(os,"register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
 def connect(
-    uri: str = "localhost",
-    port: int = 27017,
-    db_name: str = 'symptoms_db'
+    uri: str = None,
+    port: int = None,
+    db_name: str = None
 ):
     """
-    Function to connect to Mongo DB instance. 
+    Function to connect to Mongo DB instance.  Creates a new client;
+    the application uses the shared one (get_client, symptoms_db).
 
     Args:
-        uri: (str) uri to mongo instance
-        port: (int) port number mongo is listening on
+        uri: (str) uri to mongo instance (default config MONGO_HOST)
+        port: (int) port number mongo is listening on (default config
+            MONGO_PORT)
         db_name: (str) name of database to use
 
     Returns:
-        pymongo.database.Database object
+        pymongo.mongo_client.MongoClient object
 
     """
     client = pymongo.MongoClient(
-        uri,
-        port
+        uri or config.Config.MONGO_HOST,
+        port or config.Config.MONGO_PORT
     )
     return client
 
-@contextmanager
-def symptoms_db():
-    try:
-        client = connect()
-        db = client.symptoms_db
-        yield db
-    finally:
-        client.close()
+def get_client() -> pymongo.MongoClient:
+    """
+    Get the process-wide MongoClient, creating it on first use with
+    the MONGO_* settings of config.Config.
 
+    Returns:
+        pymongo.mongo_client.MongoClient object
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                c = config.Config
+                _client = pymongo.MongoClient(
+                    c.MONGO_HOST,
+                    c.MONGO_PORT,
+                    maxPoolSize = c.MONGO_MAX_POOL_SIZE,
+                    minPoolSize = c.MONGO_MIN_POOL_SIZE,
+                    connectTimeoutMS = c.MONGO_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS = \
+                        c.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS = c.MONGO_SOCKET_TIMEOUT_MS,
+                    connect = False
+                )
+    return _client
+
+def close_client() -> None:
+    """
+    Close the process-wide MongoClient (a later get_client creates a
+    new one).
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
 
+@contextmanager
+def symptoms_db():
+    """
+    Context manager handing out the application database on the
+    shared client.  Leaving the block returns nothing to close; the
+    client's connections stay pooled for the next caller.
+    """
+    yield get_client()[config.Config.MONGO_DB]
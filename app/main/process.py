@@ -21,9 +21,10 @@ def andsymptoms_pathology_df(
         pandas dataframe with one line per patient-pathology incident
             that exhibits all of the symptoms.
     """
-    symptoms_objs = api.get_andsymptoms_objs(
+    symptoms_objs = api.iter_andsymptoms_objs(
         db,
-        symptoms_list
+        symptoms_list,
+        projection = ph.DF_PROJECTION
     )
     df = ph.df_from_symptoms(symptoms_objs)
     return df
@@ -44,9 +45,10 @@ def orsymptoms_pathology_df(
         pandas dataframe with one line per patient-pathology incident
             that exhibits all of the symptoms.
     """
-    symptoms_objs = api.get_orsymptoms_objs(
+    symptoms_objs = api.iter_orsymptoms_objs(
         db,
-        symptoms_list
+        symptoms_list,
+        projection = ph.DF_PROJECTION
     )
     df = ph.df_from_symptoms(symptoms_objs)
     return df
@@ -65,7 +67,11 @@ def pathology_stats(
     Returns:
         dict containing symptom, age, and gender frequencies.
     """
-    symptom_objs = api.pathology_symptoms(db,pathology)
+    symptom_objs = api.iter_pathology_symptoms(
+        db,
+        pathology,
+        projection = ph.STATS_PROJECTION
+    )
     stats = ph.pathology_stats_from_symptoms(symptom_objs)
     return stats
 
@@ -87,8 +93,9 @@ def all_stats(
     stats = {}
     total_records = api.symtpom_collection_count_est(db)
     pathologies = symptom_pathology_df['pathology'].unique()
+    counts = api.pathology_stats_counts(db,list(pathologies))
     for p in pathologies:
-        p_stats = pathology_stats(db,p)
+        p_stats = ph.pathology_stats_from_counts(counts[p])
         p_stats['freq'] = p_stats['count']/total_records
         stats[p] = p_stats
 
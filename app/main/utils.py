@@ -18,6 +18,15 @@ def fhir_datetime(datetime_str: str) -> datetime:
     )
     return dt
 
+def as_datetime(value) -> datetime:
+    """
+    FHIR datetime fields are stored as BSON dates by load_data.py.
+    Strings (from data loaded before that) are still parsed.
+    """
+    if isinstance(value,datetime):
+        return value
+    return fhir_datetime(value)
+
 def factorgraph_save(
     fg,
     file_path: str,
@@ -38,6 +47,7 @@ def factorgraph_save(
                     function_args = n.function_args
                 )
                 new_node.neighbors = n.neighbors
+                new_node.domains = n.domains
             elif (n.__class__.__name__ \
                     == "VariableNode") or force_save:
                 new_node = VariableNode(
@@ -49,6 +59,7 @@ def factorgraph_save(
             else: 
                 raise ValueError("Invalid Node object")
             new_fg.add_node(new_node)
+        new_fg.posterior_arrays = getattr(fg,"posterior_arrays",None)
     else:
         new_fg = fg
         
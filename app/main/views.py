@@ -14,6 +14,14 @@ import json
 from collections import Counter
 
 FLASK_APP_DIR = os.environ.get('FLASK_APP') or "./app"
+# Symptoms object fields read by the empirical symptom and pathology
+# views
+EMPIRICAL_PROJECTION = {
+    "_id": 0,
+    "resource.pathology": 1,
+    "resource.symptoms.text": 1,
+    "resource.symptoms.severity": 1
+}
 
 @main.route('/',methods=['GET','POST'])
 def home():
@@ -65,7 +73,16 @@ def home():
 @main.route('/bayesian-graph/symptom_results', methods=['POST'])
 def bayes_results():
     pkl_file = os.path.join(FLASK_APP_DIR,"data","SFG.pkl")
-    if os.path.exists(pkl_file):
+    pkl_mtime = os.path.getmtime(pkl_file) if \
+        os.path.exists(pkl_file) else None
+    sfg = session.get('sfg')
+    if (sfg is not None) and (pkl_mtime is not None) and \
+            (session.get('sfg_mtime') == pkl_mtime):
+        # Keep the session's graph and its messages; sum_product on
+        # the detail pages then only recomputes the messages that
+        # depend on evidence that changed.
+        sfg.clear(messages = False)
+    elif pkl_mtime is not None:
         with open(pkl_file,'rb') as f:
             sfg = pickle.load(f)
     else:
@@ -75,6 +92,7 @@ def bayes_results():
         sfg = symptomsFactorGraph()
         sfg.build()
         utils.factorgraph_save(sfg,pkl_file)
+    session['sfg_mtime'] = os.path.getmtime(pkl_file)
 
     if not session.get("symptoms_list"):
         session['symptoms_list'] = api.get_all_symptoms(db)
@@ -114,11 +132,13 @@ def bayes_results():
     
     for symptom in pos_symptoms_list:
         sfg.set_symptom(symptom)
-    sfg.sum_product()
-    sfg.Nodes['Pathology'].compute_marginals()
+    # Messages are only passed by the detail pages that need them.
     session['sfg'] = sfg
-    prob_table = [(p,sfg.Nodes['Pathology'].marginal_pmf(p)) \
-        for p in sfg.Nodes['Pathology'].values]
+    prob_table = list(sfg.posterior(
+        age = age,
+        gender = gender,
+        symptoms = pos_symptoms_list
+    ).items())
     prob_table = [p for p in prob_table if (not math.isnan(p[1]) and \
         p[1] > 0)]
     if len(prob_table) > 0:
@@ -167,9 +187,12 @@ def conditional_symptom(symptom):
         redirect(url_for("main.home"))
     
     sfg = session.get('sfg')
+    # Does nothing if the evidence has not changed since the last run
+    sfg.sum_product(prune = True)
     age = session.get('age')
     gender = session.get('gender')
 
+    sfg.expand_branch(f"PSS_{symptom}")
     sfg.Nodes[f"PSS_{symptom}"].compute_marginals()
 
     df = pd.DataFrame(
@@ -296,6 +319,8 @@ def conditional_pathology(pathology):
         redirect(url_for("main.home"))
     
     sfg = session.get('sfg')
+    # Does nothing if the evidence has not changed since the last run
+    sfg.sum_product(prune = True)
     age = sfg.Nodes['Age'].fixed_value
     gender = sfg.Nodes['Gender'].fixed_value
 
@@ -306,6 +331,7 @@ def conditional_pathology(pathology):
     df_severity = pd.DataFrame(columns = ["Symptom","Severity",
         "Probability Density"])
     for s in symptoms:
+        sfg.expand_branch(f"PSS_{s}")
         sfg.Nodes[f"PSS_{s}"].compute_marginals()
         df_symptom = pd.DataFrame(
             tuple(
@@ -452,17 +478,12 @@ def empirical_results():
         query_filters['gender'] = gender
     
     with DB.symptoms_db() as db:
-        # Change to get_orsymptoms_objs for "OR" symptom query
-        symptom_objs = api.get_andsymptoms_objs(
+        path_counts,total_records = api.andsymptoms_pathology_counts(
             db,
             pos_symptoms_list,
             **query_filters
         )
 
-    path_counter = Counter([s['resource']['pathology'] for \
-        s in symptom_objs])
-    path_counts = path_counter.most_common()
-    total_records = len(symptom_objs)
     prob_table = [(p[0],p[1]/total_records) for p in path_counts]
     prob_table = [p for p in prob_table if (not math.isnan(p[1]) and \
         p[1] > 0)]
@@ -514,24 +535,23 @@ def empirical_symptom(symptom):
     gender = session.get('gender')
 
     with DB.symptoms_db() as db:
-        symptom_objs = api.get_andsymptoms_objs(
+        symptom_objs = api.iter_andsymptoms_objs(
             db,
             [symptom],
+            projection = EMPIRICAL_PROJECTION,
             age_begin = age,
             gender = gender
         )
 
-    tups = [
-        (
-            o['resource']['pathology'],
-            int(
+        tups = [
+            (
+                o['resource']['pathology'],
                 o['resource']['symptoms'][
                     [s['text'] for s in \
                         o['resource']['symptoms']].index(symptom)
                 ]['severity']
-            )
-        ) for o in symptom_objs
-    ]
+            ) for o in symptom_objs
+        ]
     path_symptom_counter = Counter(tups)
     path_symptoms = path_symptom_counter.most_common()
     total_records = len(tups)
@@ -658,12 +678,13 @@ def empirical_pathology(pathology):
     symptoms = session.get('pos_symptoms_list')
 
     with DB.symptoms_db() as db:
-        symptom_objs = api.get_orsymptoms_objs(
+        symptom_objs = list(api.iter_orsymptoms_objs(
             db,
             symptoms,
+            projection = EMPIRICAL_PROJECTION,
             age_begin = age,
             gender = gender
-        )
+        ))
 
     pathology_probs = []
     df_severity = pd.DataFrame(columns = ["Symptom","Severity",
@@ -676,10 +697,10 @@ def empirical_pathology(pathology):
             ['pathology'] == pathology]
         cond_prob = len(cond_intersection) / len(cond_world)
         pathology_probs.append((s,cond_prob))
-        severities = [int(o['resource']['symptoms'][
+        severities = [o['resource']['symptoms'][
             [sy['text'] for sy in o['resource']['symptoms']].\
                 index(s)
-        ]['severity']) for o in cond_intersection]
+        ]['severity'] for o in cond_intersection]
         severity_counter = Counter(severities)
         severity_counts = severity_counter.most_common()
         severity_counts.sort(key=lambda z: z[0])
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+# Benchmark pathology_stats_from_symptoms against the version that
+# re-scanned every symptom entry for each distinct symptom.
+# Uses generated symptoms objects; no database needed.
+
+import os,sys
+import time
+import numpy as np
+from collections import Counter
+
+
+
+# Need to have PYTHONPATH defined
+
+PROJECT_ROOT = os.environ.get('PROJECT_ROOT') or \
+    "../.."
+
+if not os.environ.get('PYTHONPATH'):
+    PYTHONPATH = os.path.join(
+        PROJECT_ROOT,
+        "app"
+    )
+    sys.path.append(PYTHONPATH)
+
+
+from main import _process_helpers as ph
+
+
+SIZES = [1000,10000,50000,200000]
+N_SYMPTOMS = 200
+
+
+def old_pathology_stats_from_symptoms(
+    symptom_objs: list,
+) -> dict: 
+    p_stats = {}
+
+    # Ages
+    ages = [int(s['resource']['age_begin']) for s in symptom_objs]
+    age_counter = Counter(ages)
+    age_counts = age_counter.most_common()
+    age_counts.sort(key=lambda a: a[0])
+    p_stats['age'] = {a[0]:a[1] for a in age_counts}
+
+    # Gender
+    genders = [s['resource']['gender'] for s in symptom_objs]
+    gender_counter = Counter(genders)
+    gender_counts = gender_counter.most_common()
+    gender_counts.sort(key=lambda g: g[0])
+    p_stats['gender'] = {g[0]:g[1] for g in gender_counts}
+
+    # Symptoms
+    symptoms = [o for s in symptom_objs for o in \
+        s['resource']['symptoms']]
+    symptom_text = [o['text'] for o in symptoms]
+    symptom_text_counter = Counter(symptom_text)
+    symptom_text_counts = symptom_text_counter.most_common()
+    symptom_dict = {}
+    for i,symptom_count in enumerate(symptom_text_counts):
+        symptom_dict[symptom_count[0]] = {'count':symptom_count[1]}
+        severity = [o['severity'] for o in symptoms if o['text'] == \
+            symptom_count[0]]
+        severity_counter = Counter(severity)
+        severity_counts = severity_counter.most_common()
+        severity_counts.sort(key = lambda s: s[0])
+        symptom_dict[symptom_count[0]]['severity'] = severity_counts
+    
+    p_stats['symptoms'] = symptom_dict
+
+    # Count
+    p_stats['count'] = len(symptom_objs)
+
+    return p_stats
+
+
+def make_symptom_objs(n: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    symptom_names = [f"Symptom {i}" for i in range(N_SYMPTOMS)]
+    objs = []
+    for i in range(n):
+        n_symptoms = int(rng.integers(1,8))
+        texts = rng.choice(N_SYMPTOMS,n_symptoms,replace=False)
+        objs.append({
+            "resource": {
+                "age_begin": int(rng.integers(0,100)),
+                "gender": "M" if rng.random() < 0.5 else "F",
+                "symptoms": [
+                    {
+                        "text": symptom_names[t],
+                        "severity": int(rng.integers(0,100))
+                    } for t in texts
+                ]
+            }
+        })
+    return objs
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result,time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print(f"{'objects':>8} {'old (s)':>9} {'1-pass (s)':>11} "\
+        f"{'numpy (s)':>10}")
+    for n in SIZES:
+        objs = make_symptom_objs(n)
+        old,t_old = timed(old_pathology_stats_from_symptoms,objs)
+        one_pass,t_one_pass = timed(ph._pathology_stats_counter,\
+            iter(objs))
+        vectorized,t_vectorized = timed(ph._pathology_stats_numpy,\
+            iter(objs))
+        for result in [one_pass,vectorized]:
+            assert result == old
+            assert list(result['symptoms']) == list(old['symptoms'])
+        print(f"{n:>8} {t_old:>9.3f} {t_one_pass:>11.3f} "\
+            f"{t_vectorized:>10.3f}")
@@ -9,6 +9,7 @@ import pytest
 import os,sys
 import re
 import pymongo
+from collections import Counter
 
 
 # Need to have PYTHONPATH defined
@@ -318,6 +319,45 @@ def test_andsymptom_objs_agegender(db,symptom_list,age,gender):
             symptom in symptom_list])
 
 
+@pytest.mark.parametrize(
+    ["symptom_list"],
+    [
+        (["Cough"],),
+        (["Cough","Fever"],)
+    ]
+)
+def test_iter_andsymptoms_objs(db,symptom_list):
+    projection = {"_id":0,"resource.pathology":1}
+    symptom_objs = api.iter_andsymptoms_objs(db,symptom_list,\
+        projection=projection,batch_size=10)
+    assert not isinstance(symptom_objs, list)
+    symptom_objs = list(symptom_objs)
+    assert len(symptom_objs) == len(api.get_andsymptoms_objs(db,\
+        symptom_list))
+    assert all([list(s.keys()) == ['resource'] for s in symptom_objs])
+    assert all([list(s['resource'].keys()) == ['pathology'] for \
+        s in symptom_objs])
+
+@pytest.mark.parametrize(
+    ["symptom_list","age","gender"],
+    [
+        (["Cough"],None,None),
+        (["Cough"],22,"M"),
+        (["Cough","Swollen Lymph Nodes","Fatigue","Decreased Appetite"],
+            45,"F")
+    ]
+)
+def test_andsymptoms_pathology_counts(db,symptom_list,age,gender):
+    path_counts,total_records = api.andsymptoms_pathology_counts(db,\
+        symptom_list,age_begin=age,gender=gender)
+    symptom_objs = api.get_andsymptoms_objs(db,symptom_list,\
+        age_begin=age,gender=gender)
+    assert total_records == len(symptom_objs)
+    assert dict(path_counts) == dict(Counter([s['resource']['pathology'] \
+        for s in symptom_objs]))
+    counts = [c[1] for c in path_counts]
+    assert counts == sorted(counts,reverse=True)
+
 @pytest.mark.parametrize(
     ["symptom_list"],
     [
@@ -430,3 +470,15 @@ def test_pathology_symptom_severity_counts(db,symptom):
     pss_counts = api.pathology_symptom_severity_counts(db,symptom)
     assert pss_counts[('Viral sinusitis (disorder)',True,1)] > 0
     assert pss_counts[('Normal pregnancy',False,0)] > 0
+
+@pytest.mark.parametrize(
+    ['symptom'],
+    [
+        ('Cough',),
+        ('Fever',)
+    ]
+)
+def test_all_pathology_symptom_severity_counts(db,symptom):
+    all_counts = api.all_pathology_symptom_severity_counts(db)
+    pss_counts = api.pathology_symptom_severity_counts(db,symptom)
+    assert all_counts[symptom] == pss_counts
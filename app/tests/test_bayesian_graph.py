@@ -86,8 +86,8 @@ def test_variable_message_leaf(sfg):
     agp = sfg.Nodes['AGP']
     am = sfg.Nodes['Age'].message_out(agp)
     gm = sfg.Nodes['Gender'].message_out(agp)
-    print(am[10])
-    print(gm['M'])
+    print(am[sfg.Nodes['Age'].index(10)])
+    print(gm[sfg.Nodes['Gender'].index('M')])
 
 def test_agp_message(sfg):
     agp = sfg.Nodes['AGP']
@@ -98,6 +98,20 @@ def test_agp_message(sfg):
     agp_m = agp.message_out(sfg.Nodes['Pathology'])
     print(agp_m)
 
+def test_factor_message_matches_F(sfg):
+    agp = sfg.Nodes['AGP']
+    pathology = sfg.Nodes['Pathology']
+    agp.messages_in['Age'] = sfg.Nodes['Age'].message_out(agp)
+    agp.messages_in['Gender'] = sfg.Nodes['Gender'].message_out(agp)
+    agp_m = agp.message_out(pathology)
+    assert agp_m.shape == (len(pathology.values),)
+    for p in pathology.values:
+        pr = sum([agp.F(a,g,p) for a,g in product(
+            sfg.Nodes['Age'].values,
+            sfg.Nodes['Gender'].values
+        )])
+        assert abs(agp_m[pathology.index(p)] - pr) < 0.000000001
+
 
 def test_sum_product(sfg):
     sfg.sum_product()
@@ -111,6 +125,174 @@ def test_sum_product(sfg):
     )
     
 
+def test_compile_schedule(sfg):
+    schedule = sfg.compile_schedule("Pathology")
+    names = schedule['names']
+    branch_factors = [names[f] for f,hub,leaves in schedule['branches']]
+    assert set(branch_factors) == set(
+        [n for n in sfg.Nodes if n[0:4] == "PSS_"] + ["AGP"]
+    )
+    edges = schedule['up'] + [(f,hub) for f,hub,leaves in \
+        schedule['branches']]
+    assert set([names[j] for i,j in edges]) == {"Pathology"}
+
+def test_sum_product_prune(sfg):
+    sfg.clear()
+    sfg.set_gender("F")
+    sfg.set_symptom("Cough")
+    sfg.sum_product()
+    marginals = {}
+    for n in ["Pathology","PSS_Fever","PSS_Cough"]:
+        sfg.Nodes[n].compute_marginals()
+        marginals[n] = sfg.Nodes[n].marginals
+    sfg.sum_product(prune = True)
+    assert "PSS_Fever" in sfg.pruned
+    assert "PSS_Cough" not in sfg.pruned
+    assert len(sfg.Nodes["Fever"].messages_in) == 0
+    sfg.expand_branch("PSS_Fever")
+    for n in marginals:
+        sfg.Nodes[n].compute_marginals()
+        for key,value in marginals[n].items():
+            assert abs(sfg.Nodes[n].marginals[key] - value) < 0.000000001
+    sfg.clear()
+
+@pytest.mark.parametrize(
+    "evidence",
+    [
+        {},
+        {"age": 10, "gender": "F"},
+        {"gender": "M", "symptoms": ["Cough","Fever"]},
+        {"symptoms": ["Fever"], "severities": {"Fever": 35}}
+    ]
+)
+def test_posterior(sfg,evidence):
+    sfg.clear()
+    if evidence.get("age") is not None:
+        sfg.set_age(evidence["age"])
+    if evidence.get("gender") is not None:
+        sfg.set_gender(evidence["gender"])
+    for symptom in evidence.get("symptoms",[]):
+        sfg.set_symptom(symptom)
+    for symptom,severity in evidence.get("severities",{}).items():
+        sfg.set_severity(symptom,severity)
+    sfg.sum_product()
+    sfg.Nodes['Pathology'].compute_marginals()
+    posterior = sfg.posterior(**evidence)
+    for p in sfg.Nodes['Pathology'].values:
+        assert abs(posterior[p] - \
+            sfg.Nodes['Pathology'].marginal_pmf(p)) < 0.000000001
+    sfg.clear()
+
+def test_variable_node_index():
+    n = VariableNode("X",values = ["a","b"])
+    assert n.index("b") == 1
+    n.values = ["b","a"]
+    assert n.index("b") == 0
+    n.values.append("c")
+    assert n.index("c") == 2
+    n.values.sort(reverse = True)
+    assert n.index("c") == 0
+    assert n.index("a") == 2
+    n.values[0] = "d"
+    assert n.index("d") == 0
+    with pytest.raises(KeyError):
+        n.index("c")
+
+def test_batch_posterior(sfg):
+    symptoms = ["Cough","Fever"]
+    cases = [
+        (None,None,[]),
+        (10,"F",["Cough"]),
+        (None,"M",["Cough","Fever"]),
+        (40,None,["Fever"])
+    ]
+    evidence = np.array([[int(s in c[2]) for s in symptoms] \
+        for c in cases])
+    batch = sfg.batch_posterior(
+        [c[0] for c in cases],
+        [c[1] for c in cases],
+        evidence,
+        symptoms = symptoms,
+        chunk_size = 3
+    )
+    assert batch.shape == (len(cases),len(sfg.Nodes['Pathology'].values))
+    for i,(age,gender,present) in enumerate(cases):
+        posterior = sfg.posterior(age=age,gender=gender,symptoms=present)
+        for j,p in enumerate(sfg.Nodes['Pathology'].values):
+            assert abs(batch[i,j] - posterior[p]) < 0.000000001
+
+def test_batch_posterior_absent_and_severity(sfg):
+    # evidence: 1 present, -1 absent; severities: index into the
+    # severity node's values (None if unknown)
+    symptoms = ["Cough","Fever"]
+    cases = [
+        (None,None,{"Cough": -1},{}),
+        (10,"F",{"Cough": 1,"Fever": -1},{}),
+        (None,"M",{"Cough": 1,"Fever": 1},{"Fever": 1}),
+        (40,None,{"Fever": -1},{"Cough": 1}),
+        (None,None,{"Cough": -1},{"Cough": 0}),
+        (None,"F",{"Fever": 1},{"Cough": -1,"Fever": -1})
+    ]
+    evidence = np.array([[c[2].get(s,0) for s in symptoms] \
+        for c in cases])
+    severities = np.array([[
+        sfg.Nodes[f"{s}_severity"].values[c[3][s]] if s in c[3] \
+            else np.nan for s in symptoms
+    ] for c in cases])
+    batch = sfg.batch_posterior(
+        [c[0] for c in cases],
+        [c[1] for c in cases],
+        evidence,
+        symptoms = symptoms,
+        severities = severities,
+        chunk_size = 4
+    )
+    for i,(age,gender,present,severity) in enumerate(cases):
+        sfg.clear()
+        if age is not None:
+            sfg.set_age(age)
+        if gender is not None:
+            sfg.set_gender(gender)
+        for symptom,value in present.items():
+            sfg.set_symptom(symptom,value > 0)
+        for j,symptom in enumerate(symptoms):
+            if symptom in severity:
+                sfg.set_severity(symptom,severities[i,j])
+        sfg.sum_product()
+        sfg.Nodes['Pathology'].compute_marginals()
+        if sum(sfg.Nodes['Pathology'].marginals.values()) == 0:
+            # impossible evidence
+            assert not batch[i].any()
+            continue
+        for j,p in enumerate(sfg.Nodes['Pathology'].values):
+            assert abs(batch[i,j] - \
+                sfg.Nodes['Pathology'].marginal_pmf(p)) < 0.000000001
+    sfg.clear()
+
+def test_sum_product_incremental(sfg):
+    sfg.clear()
+    sfg.set_gender("F")
+    sfg.set_symptom("Cough")
+    sfg.sum_product()
+    age_message = sfg.Nodes['AGP'].messages_in['Age']
+    fever_message = sfg.Nodes['Pathology'].messages_in['PSS_Fever']
+    sfg.set_symptom("Fever")
+    sfg.sum_product()
+    assert sfg.Nodes['AGP'].messages_in['Age'] is age_message
+    assert sfg.Nodes['Pathology'].messages_in['PSS_Fever'] is not \
+        fever_message
+    incremental = {}
+    for n in sfg.Nodes:
+        sfg.Nodes[n].compute_marginals()
+        incremental[n] = sfg.Nodes[n].marginals
+    sfg.clear(values = False)
+    sfg.sum_product()
+    for n in sfg.Nodes:
+        sfg.Nodes[n].compute_marginals()
+        for key,value in sfg.Nodes[n].marginals.items():
+            assert abs(incremental[n][key] - value) < 0.000000001
+    sfg.clear()
+
 def test_sum_product_gender(sfg):
     sfg.set_gender("M")
     sfg.sum_product()
@@ -141,7 +323,7 @@ def test_sum_product_gender(sfg):
                 "Fever_severity": 35
             },
             {
-                "resource.symptoms":{"$elemMatch":{"text":"Fever","severity":"35"}}
+                "resource.symptoms":{"$elemMatch":{"text":"Fever","severity":35}}
             }
         ),
         (
@@ -149,7 +331,7 @@ def test_sum_product_gender(sfg):
                 "Fever_severity": 35
             },
             {
-                "resource.symptoms":{"$elemMatch":{"text":"Fever","severity":"35"}}
+                "resource.symptoms":{"$elemMatch":{"text":"Fever","severity":35}}
             }
         )
     ]
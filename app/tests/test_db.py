@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+# Test shared mongo client
+
+import pytest
+import os,sys
+
+
+# Need to have PYTHONPATH defined
+
+PROJECT_ROOT = os.environ.get('PROJECT_ROOT') or \
+    "../.."
+
+if not os.environ.get('PYTHONPATH'):
+    PYTHONPATH = os.path.join(
+        PROJECT_ROOT,
+        "app"
+    )
+    sys.path.append(PYTHONPATH)
+
+
+from main import db as DB
+
+
+def test_get_client_shared():
+    assert DB.get_client() is DB.get_client()
+
+def test_symptoms_db_shared():
+    with DB.symptoms_db() as db1:
+        with DB.symptoms_db() as db2:
+            assert db1.client is db2.client
+            assert db1.name == db2.name
+
+def test_close_client():
+    client = DB.get_client()
+    DB.close_client()
+    assert DB.get_client() is not client
+
+@pytest.mark.skipif(not hasattr(os,"fork"),reason="needs os.fork")
+def test_client_after_fork():
+    parent_client = DB.get_client()
+    r,w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        new_client = DB.get_client() is not parent_client
+        os.write(w,b"1" if new_client else b"0")
+        os._exit(0)
+    os.close(w)
+    result = os.read(r,1)
+    os.waitpid(pid,0)
+    assert result == b"1"
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Test mongo index module
+
+# Need to make sure mongodb is running
+#  and accessible at port 27017
+
+import pytest
+import os,sys
+
+
+# Need to have PYTHONPATH defined
+
+PROJECT_ROOT = os.environ.get('PROJECT_ROOT') or \
+    "../.."
+
+if not os.environ.get('PYTHONPATH'):
+    PYTHONPATH = os.path.join(
+        PROJECT_ROOT,
+        "app"
+    )
+    sys.path.append(PYTHONPATH)
+    # indexes.py sits next to load_data.py
+    sys.path.append(PROJECT_ROOT)
+
+
+import indexes
+from main import db as DB
+
+
+## Use api connect as fixture
+@pytest.fixture(scope="module")
+def db():
+    client = DB.connect()
+    symptoms_db = client.symptoms_db
+    return symptoms_db
+
+@pytest.fixture(scope="module")
+def index_report(db):
+    return indexes.create_indexes(db)
+
+def test_create_indexes(db,index_report):
+    n_declared = sum([len(i) for i in indexes.INDEXES.values()])
+    assert len(index_report) == n_declared
+    for r in index_report:
+        assert r['name'] in db[r['collection']].index_information()
+        assert r['seconds'] >= 0
+
+def test_index_sizes(db,index_report):
+    sizes = indexes.index_sizes(db)
+    for r in index_report:
+        assert sizes[r['collection']][r['name']] > 0
+
+@pytest.mark.parametrize(
+    ["collection","query"],
+    [
+        ("Patient",{"fullUrl":"urn:uuid:none"}),
+        ("Patient",{"_source":{"$in":["none.json"]}}),
+        ("symptoms",{"resource.symptoms.text":{"$all":["Fever"]}}),
+        ("symptoms",{"resource.pathology":"COVID-19"}),
+        ("Condition",{"resource.encounter.reference":"urn:uuid:none"})
+    ]
+)
+def test_query_uses_index(db,index_report,collection,query):
+    plan = db[collection].find(query).explain()
+    assert "IXSCAN" in str(plan['queryPlanner']['winningPlan'])
+
+@pytest.mark.parametrize(
+    "collection",
+    ["Organization","Practitioner","PractitionerRole","Location"]
+)
+def test_shared_resources_unique(db,index_report,collection):
+    n_docs = db[collection].count_documents({})
+    assert len(db[collection].distinct("fullUrl")) == n_docs
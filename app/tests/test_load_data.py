@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+# Test load_data module (parsing only; no mongodb needed)
+
+import pytest
+import os,sys
+import io
+import json
+import pandas as pd
+from datetime import datetime
+import bson
+
+
+# Need to have PYTHONPATH defined
+
+PROJECT_ROOT = os.environ.get('PROJECT_ROOT') or \
+    "../.."
+
+# load_data.py sits at the project root
+sys.path.append(PROJECT_ROOT)
+
+
+import load_data
+
+
+@pytest.mark.parametrize(
+    ["symptoms","severities"],
+    [
+        ("Fever:12:3;Cough:40:7",[12,40]),
+        ("Fever:1.5:2.9",[1]),
+        ("Fever:-2.5:0",[-2]),
+        ("Fever: 7 :1",[7]),
+        ("Fever:x:1;Cough:nan:1;Fatigue:inf:1",[0,0,0]),
+        ("Fever::;Cough",[0,0]),
+        ("Fever:1e1:1",[10]),
+    ]
+)
+def test_parse_symptoms_chunk_matches_parse_symptoms(symptoms,severities):
+    df = pd.DataFrame({
+        "SYMPTOMS": [symptoms,"",symptoms],
+        "NUM_SYMPTOMS": [len(severities),0,len(severities)]
+    })
+    by_row = [load_data.parse_symptoms(row) for _,row in df.iterrows()]
+    by_chunk = load_data.parse_symptoms_chunk(df)
+    assert by_chunk == by_row
+    assert [s['severity'] for s in by_chunk[0]] == severities
+    for s in by_chunk[0]:
+        assert type(s['severity']) == type(s['duration']) == int
+
+
+@pytest.mark.parametrize(
+    ["onset","age"],
+    [
+        # the evening before the 10th birthday is 2010-06-15 in UTC
+        ("2010-06-14T23:30:00-05:00",9),
+        ("2010-06-15T23:30:00-05:00",10),
+        # the 10th birthday is still 2010-06-14 in UTC
+        ("2010-06-15T00:30:00+05:00",10),
+        ("2010-06-14T12:00:00+00:00",9)
+    ]
+)
+def test_age_uses_local_onset_date(onset,age):
+    birthDate = datetime(2000,6,15)
+    entry = {
+        "fullUrl": "urn:uuid:c1",
+        "resource": {"resourceType": "Condition","onsetDateTime": onset}
+    }
+    # as stored and read back by pymongo: a naive UTC datetime
+    stored = bson.decode(bson.encode(load_data.normalize_entry(entry)))
+    onset_dt = load_data.local_datetime(
+        stored['resource']['onsetDateTime'],
+        stored['_utc_offsets']['onsetDateTime']
+    )
+    assert onset_dt == load_data.str2datetime(onset)
+    assert load_data.age_in_years(onset_dt,birthDate) == age
+    conditions = [
+        {'datetime': onset_dt,'condition': {'fullUrl': "first"}},
+        {
+            'datetime': load_data.str2datetime("2011-01-01T12:00:00-05:00"),
+            'condition': {'fullUrl': "second"}
+        }
+    ]
+    selected = load_data.select_condition(conditions,birthDate,10)
+    assert selected['fullUrl'] == ("first" if age == 10 else "second")
+
+
+ENTRY = {
+    "fullUrl": "urn:uuid:0f1e2d3c",
+    "resource": {
+        "resourceType": "Observation",
+        "valueQuantity": {"value": 1234567890123, "unit": "mg"},
+        "small": -1.25e-3,
+        "flags": [True, False, None, 0, 22, 333],
+        "text": "a \"quoted\" \\u00e9 \u00e9 ,:]} string",
+        "empty": {"list": [], "object": {}}
+    }
+}
+
+@pytest.mark.parametrize(
+    ["bundle","indent"],
+    [
+        ({"resourceType": "Bundle", "entry": [ENTRY,{},ENTRY],
+            "type": "transaction", "total": 987654321},None),
+        ({"resourceType": "Bundle", "entry": [ENTRY,{},ENTRY],
+            "type": "transaction", "total": 987654321},2),
+        ({"entry": [], "type": "transaction"},None),
+        ({"entry": [{}]},1),
+        ({"entry": [12345678,"x",[[]]], "z": [ENTRY]},None),
+    ]
+)
+def test_iter_bundle_entries(tmp_path,bundle,indent):
+    file_path = tmp_path / "bundle.json"
+    file_path.write_text(json.dumps(bundle,indent=indent))
+    with open(file_path) as f:
+        expected = json.load(f)['entry']
+    # Small chunk sizes cut numbers, strings, and delimiters at every
+    # position
+    for chunk_size in list(range(2,24)) + [load_data.PARSE_CHUNK_SIZE]:
+        entries = list(load_data.iter_bundle_entries(file_path,chunk_size))
+        assert entries == expected, chunk_size
+
+def test_json_stream_bounded_reads(tmp_path):
+    text = '{"entry": [{"a": 1}, {"a": x}' + ', {"a": 1}'*10000 + ']}'
+    f = io.StringIO(text)
+    stream = load_data._JSONStream(f,chunk_size=16,max_reads=3)
+    stream.expect("{")
+    assert stream.decode() == "entry"
+    stream.expect(":")
+    stream.expect("[")
+    assert stream.decode() == {"a": 1}
+    assert stream.skip(",")
+    with pytest.raises(ValueError):
+        stream.decode()
+    assert f.tell() < 16*2**5
+    file_path = tmp_path / "bundle.json"
+    file_path.write_text(text)
+    with pytest.raises(ValueError):
+        list(load_data.iter_bundle_entries(file_path))
@@ -95,4 +95,11 @@ def test_all_stats(db,symptom_pathology_dataframe):
     assert len(all_pathologies) == len(stats)
     assert sum([p['freq'] for p in stats.values()]) > 0
 
+def test_all_stats_match_pathology_stats(db,symptom_pathology_dataframe):
+    stats = process.all_stats(db,symptom_pathology_dataframe)
+    for p in stats:
+        p_stats = process.pathology_stats(db,p)
+        p_stats['freq'] = stats[p]['freq']
+        assert stats[p] == p_stats
+
 
@@ -192,3 +192,26 @@ def test_pathology_stats_from_symptoms(db,pathology):
     assert sum(pathology_stats['age'].values()) == len(symptom_objs)
     assert sum(pathology_stats['gender'].values()) == len(symptom_objs)
     assert pathology_stats['count'] == len(symptom_objs)
+
+@pytest.mark.parametrize(
+    ["pathology"],
+    [
+        ("COVID-19",),
+        ("Joint pain (finding)",)
+    ]
+)
+def test_pathology_stats_numpy(db,pathology,monkeypatch):
+    symptom_objs = api.pathology_symptoms(db,pathology)
+    pathology_stats = ph._pathology_stats_counter(iter(symptom_objs))
+    numpy_stats = ph._pathology_stats_numpy(iter(symptom_objs))
+    assert numpy_stats == pathology_stats
+    assert list(numpy_stats['symptoms']) == \
+        list(pathology_stats['symptoms'])
+    # a cursor long enough is routed to the numpy path
+    monkeypatch.setattr(ph,"STATS_NUMPY_MIN_OBJS",2)
+    monkeypatch.setattr(ph,"_pathology_stats_counter",None)
+    cursor_stats = ph.pathology_stats_from_symptoms(
+        api.iter_pathology_symptoms(db,pathology,\
+            projection=ph.STATS_PROJECTION)
+    )
+    assert cursor_stats == pathology_stats
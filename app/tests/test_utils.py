@@ -57,6 +57,23 @@ def test_fhir_datetime(datetime_str,correct_dt):
     dt = utils.fhir_datetime(datetime_str)
     assert dt == correct_dt
 
+@pytest.mark.parametrize(
+    "value",
+    [
+        "1949-07-19T13:15:21-04:00",
+        datetime(1949,7,19,13,15,21,\
+            tzinfo=timezone(timedelta(hours=-4))),
+        datetime(1949,7,19,17,15,21)
+    ]
+)
+def test_as_datetime(value):
+    dt = utils.as_datetime(value)
+    assert isinstance(dt,datetime)
+    if dt.tzinfo is None:
+        # BSON dates are returned as naive UTC datetimes
+        dt = dt.replace(tzinfo=timezone.utc)
+    assert dt == datetime(1949,7,19,17,15,21,tzinfo=timezone.utc)
+
 def test_factorgraph_save():
     FACTORGRAPH_PATH = os.path.join(
         PROJECT_ROOT,
@@ -46,7 +46,7 @@ docker run --rm -d \
     mongo
 
 
-## Get synthea and generate records
+## Get synthea and generate records (in the background)
 
 echo "\n\n============= GETTING SYNTHEA & GENERATING RECORDS ==============\n"
 
@@ -79,14 +79,17 @@ java -jar $PROJECT_ROOT/synthea-bin/synthea.jar \
     --exporter.years_of_history 0 \
     --exporter.symptoms.csv.export true \
     --generate.only_dead_patients true \
-    --exporter.use_uuid_filenames true
+    --exporter.use_uuid_filenames true &
 
+SYNTHEA_PID=$!
 
-## Load data into mongo database
+
+## Load data into mongo database while synthea writes it
 
 echo "\n\n================= LOADING RECORDS INTO MONGO DB =================\n"
 
-python load_data.py
+python load_data.py --full --watch --synthea-pid $SYNTHEA_PID
+wait $SYNTHEA_PID
 
 ## Start flask app
 
@@ -0,0 +1,170 @@
+import time
+import pymongo
+
+# Indexes needed by the query paths in app/main/api.py and
+# load_data.py, by collection.  Each item is (keys, options) as passed
+# to pymongo.collection.Collection.create_index.  Bundle resources are
+# also indexed on _source, the file(s) they were loaded from, which
+# load_data.remove_sources uses to delete the documents of changed and
+# deleted files.
+INDEXES = {
+    "Patient": [
+        # get_patient_info, get_multiple_patient_info,
+        # load_data.get_patient_by_id
+        ([("fullUrl", pymongo.ASCENDING)], {}),
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "Encounter": [
+        # get_encounter_info, get_multiple_encounter_info
+        ([("fullUrl", pymongo.ASCENDING)], {}),
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "Condition": [
+        # load_data.get_patient_pathology_encounters
+        (
+            [
+                ("resource.subject.reference", pymongo.ASCENDING),
+                ("resource.code.text", pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        # get_encounter_conditions
+        ([("resource.encounter.reference", pymongo.ASCENDING)], {}),
+        # get_encounters_with_symptoms, get_all_symptoms_old
+        ([("resource.code.text", pymongo.ASCENDING)], {}),
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "DiagnosticReport": [
+        # get_diagnosticReport_data (multikey)
+        ([("resource.category.coding.code", pymongo.ASCENDING)], {}),
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    # The largest of the remaining bundle resource types
+    "Observation": [
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "Claim": [
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "ExplanationOfBenefit": [
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    # Resources shared by many bundles are stored once; load_data.py
+    # upserts them by fullUrl.
+    "Organization": [
+        ([("fullUrl", pymongo.ASCENDING)], {"unique": True}),
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "Practitioner": [
+        ([("fullUrl", pymongo.ASCENDING)], {"unique": True}),
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "PractitionerRole": [
+        ([("fullUrl", pymongo.ASCENDING)], {"unique": True}),
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "Location": [
+        ([("fullUrl", pymongo.ASCENDING)], {"unique": True}),
+        ([("_source", pymongo.ASCENDING)], {}),
+    ],
+    "symptoms": [
+        # get_andsymptoms_objs ($all), get_orsymptoms_objs ($in),
+        # optionally filtered by age_begin and gender (multikey)
+        (
+            [
+                ("resource.symptoms.text", pymongo.ASCENDING),
+                ("resource.age_begin", pymongo.ASCENDING),
+                ("resource.gender", pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        # pathology_symptoms, get_all_pathologies
+        (
+            [
+                ("resource.pathology", pymongo.ASCENDING),
+                ("resource.age_begin", pymongo.ASCENDING),
+                ("resource.gender", pymongo.ASCENDING)
+            ],
+            {}
+        ),
+    ],
+}
+
+
+def create_indexes(
+    db: pymongo.database.Database,
+    collections: list = None
+) -> list:
+    """
+    Build the indexes declared in INDEXES.  Indexes that already
+    exist are left as they are.
+
+    Args:
+        db: (pymongo.database.Database) Mongo database connection
+        collections: (list) collection names to index (default None,
+            all collections in INDEXES)
+
+    Returns:
+        list of dicts with the collection, index name, and build time
+            (seconds) of each index
+    """
+    if collections is None:
+        collections = list(INDEXES.keys())
+    report = []
+    for collection in collections:
+        for keys,options in INDEXES.get(collection,[]):
+            start = time.time()
+            name = db[collection].create_index(keys,**options)
+            report.append({
+                "collection": collection,
+                "name": name,
+                "seconds": time.time() - start
+            })
+    return report
+
+
+def index_sizes(
+    db: pymongo.database.Database,
+    collections: list = None
+) -> dict:
+    """
+    Get the size of every index of the given collections.
+
+    Args:
+        db: (pymongo.database.Database) Mongo database connection
+        collections: (list) collection names (default None, all
+            collections in INDEXES)
+
+    Returns:
+        dict of {collection: {index name: size in bytes}}
+    """
+    if collections is None:
+        collections = list(INDEXES.keys())
+    existing = db.list_collection_names()
+    sizes = {}
+    for collection in collections:
+        if collection in existing:
+            stats = db[collection].aggregate([
+                {"$collStats": {"storageStats": {}}}
+            ])
+            sizes[collection] = {}
+            for stat in stats:
+                sizes[collection].update(
+                    stat['storageStats'].get('indexSizes',{})
+                )
+    return sizes
+
+
+def print_index_report(
+    report: list,
+    sizes: dict
+) -> None:
+    """
+    Print build times (from create_indexes) and sizes (from
+    index_sizes) of indexes.
+    """
+    for r in report:
+        size = sizes.get(r['collection'],{}).get(r['name'])
+        size_str = "?" if size is None else f"{size/2**20:.1f} MB"
+        print(f"Index {r['collection']}.{r['name']}: "\
+            f"{r['seconds']:.1f} s, {size_str}")
@@ -3,11 +3,365 @@
 import pymongo
 import json
 import os,sys
-from datetime import datetime
+from datetime import datetime,timezone,timedelta
 import re
 import pandas as pd
 import uuid
+import time
+import argparse
+import multiprocessing
+import hashlib
+import gzip
+import shutil
+from collections import Counter
 
+import indexes
+
+
+
+DEFAULT_BATCH_SIZE = 1000
+PARSE_CHUNK_SIZE = 1 << 20
+# Reads (each twice as large as the last) after which a JSON value
+# that still does not decode is taken to be malformed
+PARSE_MAX_READS = 8
+SYMPTOMS_CHUNKSIZE = 100000
+SYMPTOMS_REP_KEYS = ['PATIENT','PATHOLOGY','AGE_BEGIN']
+MANIFEST_COLLECTION = "_load_manifest"
+GENERATION_COLLECTION = "_dataset"
+STAGING_SUFFIX = "__staging"
+# Resources that many bundles share (the hospitalInformation and
+# practitionerInformation bundles, and every patient bundle that
+# references them).  They are stored once per fullUrl, with the list
+# of files that contain them in _source.
+SHARED_RESOURCE_TYPES = ["Organization","Practitioner",\
+    "PractitionerRole","Location"]
+WATCH_POLL_INTERVAL = 1.0
+WATCH_SETTLE = 5.0
+WATCH_IDLE_TIMEOUT = 300.0
+
+# FHIR datetime fields stored as BSON dates rather than strings, by
+# resourceType.  Each field is a path of keys into the resource.  BSON
+# dates are UTC, so the UTC offset (minutes) of each source string is
+# kept in the document's _utc_offsets, keyed by "_".join(path), for
+# computations on local calendar dates (see local_datetime).
+DATETIME_FIELDS = {
+    "Condition": [
+        ("onsetDateTime",),
+        ("abatementDateTime",),
+        ("recordedDate",)
+    ],
+    "Encounter": [
+        ("period","start"),
+        ("period","end")
+    ]
+}
+
+# Load profiles.  "full" stores every resource as it is in the bundle.
+# "analytics" stores only the resource types the application reads,
+# projected to the fields it reads (plus resourceType and id); other
+# resource types (Claim, ExplanationOfBenefit, Observation,
+# DiagnosticReport, ...) are not stored.
+PROFILES = {
+    "full": None,
+    "analytics": {
+        "Patient": ["birthDate","gender"],
+        "Condition": ["code","subject","encounter","onsetDateTime",\
+            "abatementDateTime","recordedDate"],
+        "Encounter": ["status","class","type","period","reasonCode",\
+            "subject"]
+    }
+}
+
+
+class BulkWriter(object):
+    """
+    Buffers documents by target collection and writes each buffer
+    with one unordered insert_many once it holds batch_size
+    documents.  Shared resources (see upsert) are buffered separately
+    and written with one unordered bulk_write of upserts.  Use as a
+    context manager: all buffers are flushed when the block exits,
+    including when it exits with an error.
+    """
+
+    def __init__(self,db_cxn,batch_size=DEFAULT_BATCH_SIZE):
+        self.db_cxn = db_cxn
+        self.batch_size = max(int(batch_size),1)
+        self.buffers = {}
+        self.upserts = {}
+        self.counts = Counter()
+        self.upserted = Counter()
+
+    def add(self,collection,doc):
+        buffer = self.buffers.setdefault(collection,[])
+        buffer.append(doc)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def upsert(self,collection,url,source,doc=None):
+        """
+        Buffer a de-duplicating write of a shared resource: doc is
+        inserted unless a document with fullUrl url exists, and source
+        is added to the stored document's _source list either way.
+        Leave out doc to only add source to a document that has
+        already been written.
+        """
+        buffer = self.upserts.setdefault(collection,{})
+        if url not in buffer:
+            buffer[url] = [None,set()]
+        if doc is not None:
+            buffer[url][0] = doc
+        buffer[url][1].add(source)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def _flush_upserts(self,name):
+        ops = []
+        for url,(doc,sources) in self.upserts.pop(name,{}).items():
+            update = {"$addToSet": {"_source": {"$each": sorted(sources)}}}
+            if doc is not None:
+                update["$setOnInsert"] = doc
+            ops.append(pymongo.UpdateOne({"fullUrl": url},update,\
+                upsert=(doc is not None)))
+        if len(ops) == 0:
+            return
+        try:
+            result = self.db_cxn[name].bulk_write(ops,ordered=False)
+            self.upserted[name] += result.upserted_count
+        except pymongo.errors.BulkWriteError as e:
+            # Another worker inserted the same fullUrl first; the
+            # retried upserts only add the source.
+            errors = e.details['writeErrors']
+            if any([err['code'] != 11000 for err in errors]):
+                raise
+            self.upserted[name] += e.details['nUpserted']
+            self.db_cxn[name].bulk_write([ops[err['index']] for err in \
+                errors],ordered=False)
+        self.counts[name] += len(ops)
+
+    def flush(self,collection=None):
+        if collection is None:
+            collections = list(set(self.buffers.keys()) | \
+                set(self.upserts.keys()))
+        else:
+            collections = [collection]
+        for name in collections:
+            docs = self.buffers.pop(name,[])
+            if len(docs) > 0:
+                self.db_cxn[name].insert_many(docs,ordered=False)
+                self.counts[name] += len(docs)
+            self._flush_upserts(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            # Keep what was parsed before the error, but do not let
+            # a failed flush mask the original exception.
+            try:
+                self.flush()
+            except pymongo.errors.PyMongoError as e:
+                print(f"Flush after error failed: {e}")
+        return False
+
+
+## Staging collections.  A full reload is written into staging copies
+## of the collections, which are indexed and then renamed over the
+## live ones, so the app never reads a half-loaded dataset.
+
+class StagingDatabase(object):
+    """
+    Stand-in for a pymongo Database whose collections are the staging
+    copies (name + suffix) of the live collections.  The loader
+    functions read and write through it unchanged.
+    """
+
+    def __init__(self,db_cxn,suffix=STAGING_SUFFIX):
+        self.db_cxn = db_cxn
+        self.suffix = suffix
+
+    def __getitem__(self,name):
+        return self.db_cxn[name + self.suffix]
+
+    def __getattr__(self,name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        return [c[:-len(self.suffix)] for c in \
+            self.db_cxn.list_collection_names() if \
+            c.endswith(self.suffix)]
+
+    def drop(self):
+        for name in self.list_collection_names():
+            self[name].drop()
+
+def swap_staging(db_cxn,collections=None):
+    """
+    Rename staging collections over the live ones (renameCollection
+    with dropTarget).  With collections=None every staging collection
+    is swapped in and live collections without a staging copy are
+    dropped, which completes a full reload.
+
+    Returns:
+        list of swapped collection names
+    """
+    staging = StagingDatabase(db_cxn)
+    staged = staging.list_collection_names()
+    if collections is not None:
+        staged = [c for c in staged if c in collections]
+    for name in staged:
+        staging[name].rename(name,dropTarget=True)
+    if collections is None:
+        for name in db_cxn.list_collection_names():
+            if (name not in staged) and \
+                (name != GENERATION_COLLECTION) and \
+                (not name.startswith("system.")) and \
+                (not name.endswith(STAGING_SUFFIX)):
+                db_cxn[name].drop()
+    print(f"Swapped in {len(staged)} staging collections")
+    return staged
+
+def record_generation(db_cxn,collections,profile="full"):
+    """
+    Increment the live dataset generation, recording the load profile
+    of the live data.
+
+    Returns:
+        int new generation number
+    """
+    record = db_cxn[GENERATION_COLLECTION].find_one_and_update(
+        {"_id": "live"},
+        {
+            "$inc": {"generation": 1},
+            "$set": {
+                "updated_at": datetime.now(timezone.utc),
+                "collections": sorted(collections),
+                "profile": profile
+            }
+        },
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    print(f"Dataset generation {record['generation']} is live")
+    return record['generation']
+
+
+## Streaming bundle parser.  Bundles of long-lived patients can be
+## hundreds of MB, so entries are decoded one at a time from a
+## sliding window over the file instead of json.load-ing the bundle.
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_DELIMITERS = " \t\n\r,:]}"
+
+class _JSONStream(object):
+    """
+    Holds the unread part of a JSON text file and decodes one value
+    at a time from it, reading more of the file only when needed.
+    """
+
+    def __init__(self,f,chunk_size=PARSE_CHUNK_SIZE,\
+            max_reads=PARSE_MAX_READS):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.max_reads = max_reads
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self,size):
+        data = self.f.read(size)
+        if data == "":
+            self.eof = True
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return data != ""
+
+    def peek(self):
+        while True:
+            self.pos = _JSON_WHITESPACE.match(self.buf,self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill(self.chunk_size):
+                raise ValueError("Unexpected end of JSON file")
+
+    def expect(self,char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} "\
+                "of JSON buffer")
+        self.pos += 1
+
+    def skip(self,char):
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def decode(self):
+        """
+        Decode the next value.  If it does not decode after max_reads
+        more reads, it is malformed (or very large), and the error is
+        raised instead of reading the rest of the file.
+        """
+        self.peek()
+        size = self.chunk_size
+        reads = 0
+        while True:
+            try:
+                obj,end = _JSON_DECODER.raw_decode(self.buf,self.pos)
+            except json.JSONDecodeError:
+                if (reads == self.max_reads) or (not self._fill(size)):
+                    raise
+                reads += 1
+                size *= 2
+                continue
+            if (not self.eof) and ((end == len(self.buf)) or \
+                    (self.buf[end] not in _JSON_DELIMITERS)):
+                # a number cut by the end of the buffer decodes as
+                # a shorter number; read on and decode it again
+                if reads == self.max_reads:
+                    raise ValueError(f"JSON value at offset {self.pos} "\
+                        "of JSON buffer is not followed by a delimiter")
+                self._fill(size)
+                reads += 1
+                size *= 2
+                continue
+            self.pos = end
+            return obj
+
+def iter_bundle_entries(file_path,chunk_size=PARSE_CHUNK_SIZE,\
+        max_reads=PARSE_MAX_READS):
+    """
+    Yield the objects of a FHIR bundle's top-level "entry" array one
+    at a time.  Memory use is bounded by chunk_size plus the size of
+    the largest single entry; a value that does not decode within
+    about 2**max_reads * chunk_size characters raises a ValueError.
+    """
+    with open(file_path,'r') as f:
+        stream = _JSONStream(f,chunk_size,max_reads)
+        stream.expect("{")
+        if stream.skip("}"):
+            return
+        while True:
+            key = stream.decode()
+            stream.expect(":")
+            if key == "entry":
+                stream.expect("[")
+                if not stream.skip("]"):
+                    while True:
+                        yield stream.decode()
+                        if not stream.skip(","):
+                            break
+                    stream.expect("]")
+            else:
+                stream.decode()
+            if not stream.skip(","):
+                break
+        stream.expect("}")
 
 
 def get_patient_by_id(db_cxn,patient_id):
@@ -19,6 +373,80 @@ def str2datetime(input_str):
     dt = datetime.strptime(fixed_str,"%Y-%m-%dT%H:%M:%S%z")
     return dt
 
+def local_datetime(value,utc_offset=None):
+    """
+    Datetime of a stored FHIR datetime field in its source time zone:
+    BSON dates (naive UTC) are shifted by utc_offset minutes (see
+    normalize_entry; None is UTC), and strings (from loads before
+    datetimes were stored as BSON dates) are parsed with their own
+    offset.
+    """
+    if isinstance(value,str):
+        return str2datetime(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone(timedelta(minutes=utc_offset or 0)))
+
+def normalize_entry(entry):
+    """
+    Convert the DATETIME_FIELDS of a bundle entry to datetimes, in
+    place, so that they are stored as BSON dates, and record their
+    UTC offsets in entry["_utc_offsets"].
+    """
+    resource = entry["resource"]
+    offsets = {}
+    for path in DATETIME_FIELDS.get(resource["resourceType"],[]):
+        parent = resource
+        for key in path[:-1]:
+            parent = parent.get(key)
+            if not isinstance(parent,dict):
+                break
+        else:
+            value = parent.get(path[-1])
+            if isinstance(value,str):
+                dt = str2datetime(value)
+                parent[path[-1]] = dt
+                offsets["_".join(path)] = \
+                    int(dt.utcoffset().total_seconds()) // 60
+    if len(offsets) > 0:
+        entry["_utc_offsets"] = offsets
+    return entry
+
+def project_entry(entry,fields):
+    """
+    Compact copy of a bundle entry keeping only the given resource
+    fields (see PROFILES).
+    """
+    resource = entry["resource"]
+    return {
+        "fullUrl": entry["fullUrl"],
+        "resource": {k: resource[k] for k in \
+            ["resourceType","id"] + fields if k in resource}
+    }
+
+def archive_bundle(file_path,archive_dir):
+    """
+    Write a gzip compressed copy of a bundle file to archive_dir.
+    """
+    archive_path = os.path.join(archive_dir,\
+        os.path.basename(file_path) + ".gz")
+    tmp_path = archive_path + ".tmp"
+    with open(file_path,'rb') as f_in, gzip.open(tmp_path,'wb') as f_out:
+        shutil.copyfileobj(f_in,f_out,PARSE_CHUNK_SIZE)
+    os.replace(tmp_path,archive_path)
+    return archive_path
+
+def symptom_int(value):
+    # severity and duration are stored as ints, truncated like in
+    # parse_symptoms_chunk; missing and non-numeric values are 0
+    try:
+        value = float(value)
+    except (TypeError,ValueError):
+        return 0
+    if abs(value) < float("inf"):
+        return int(value)
+    return 0
+
 def get_patient_pathology_encounters(db_cxn,patient_id,pathology):
     conditions = db_cxn.Condition.find(
         {
@@ -28,7 +456,8 @@ def get_patient_pathology_encounters(db_cxn,patient_id,pathology):
     )
     cond_list = list(conditions)
     if len(cond_list) > 0:
-        onset_dts = [str2datetime(cond['resource']['onsetDateTime'])\
+        onset_dts = [local_datetime(cond['resource']['onsetDateTime'],\
+            cond.get('_utc_offsets',{}).get('onsetDateTime')) \
             for cond in cond_list]
         output = [
             {
@@ -55,15 +484,14 @@ def age_in_years(encounter_dt, birthDate):
         age = year1 - year0 - 1
     return age
 
-def find_symptoms_condition(db_cxn,symptom_row,rep=0):
-    patient_id = f"urn:uuid:{symptom_row['PATIENT']}"
-    age_begin = symptom_row['AGE_BEGIN']
-    pathology = symptom_row['PATHOLOGY']
-    patient_obj = get_patient_by_id(db_cxn,patient_id)
-    conditions = get_patient_pathology_encounters(db_cxn,patient_id,\
-        pathology)
-    patient_birthDate = datetime.strptime(patient_obj['resource']\
-        ['birthDate'],"%Y-%m-%d")
+def select_condition(conditions,patient_birthDate,age_begin,rep=0):
+    """
+    Pick the condition a symptoms row refers to: the rep-th condition
+    (clamped to the last one) starting at the first onset at which
+    the patient was at least age_begin years old.  conditions is a
+    list sorted by onset, as returned by
+    get_patient_pathology_encounters.
+    """
     ages = [age_in_years(cond['datetime'],patient_birthDate) \
             for cond in conditions]
     agecheck_bool = [a >= age_begin for a in ages]
@@ -82,7 +510,82 @@ def find_symptoms_condition(db_cxn,symptom_row,rep=0):
         }
     return cond_out
 
-def create_symptom_entry(symptom_row,condition):
+def find_symptoms_condition(db_cxn,symptom_row,rep=0):
+    patient_id = f"urn:uuid:{symptom_row['PATIENT']}"
+    age_begin = symptom_row['AGE_BEGIN']
+    pathology = symptom_row['PATHOLOGY']
+    patient_obj = get_patient_by_id(db_cxn,patient_id)
+    conditions = get_patient_pathology_encounters(db_cxn,patient_id,\
+        pathology)
+    patient_birthDate = datetime.strptime(patient_obj['resource']\
+        ['birthDate'],"%Y-%m-%d")
+    return select_condition(conditions,patient_birthDate,age_begin,rep)
+
+
+class ConditionJoin(object):
+    """
+    In-memory version of find_symptoms_condition.  Patient birthDates
+    and the onsets of every (patient, pathology) Condition are read
+    in a single pass over each collection and sorted once per key, so
+    each symptoms row is matched with dictionary lookups instead of
+    two queries.
+    """
+
+    def __init__(self,db_cxn,pathologies=None,patients=None):
+        self.birthDates = {}
+        patient_query = {}
+        query = {}
+        if patients is not None:
+            patient_query["fullUrl"] = {"$in": list(patients)}
+            query["resource.subject.reference"] = {"$in": list(patients)}
+        patient_cursor = db_cxn.Patient.find(
+            patient_query,
+            {"_id":0,"fullUrl":1,"resource.birthDate":1}
+        )
+        for patient in patient_cursor:
+            self.birthDates[patient['fullUrl']] = datetime.strptime(\
+                patient['resource']['birthDate'],"%Y-%m-%d")
+
+        if pathologies is not None:
+            query["resource.code.text"] = {"$in": list(pathologies)}
+        cursor = db_cxn.Condition.find(
+            query,
+            {
+                "_id":0,
+                "fullUrl":1,
+                "resource.subject.reference":1,
+                "resource.code.text":1,
+                "resource.onsetDateTime":1,
+                "resource.encounter.reference":1,
+                "_utc_offsets.onsetDateTime":1
+            }
+        )
+        self.conditions = {}
+        for cond in cursor:
+            key = (
+                cond['resource']['subject']['reference'],
+                cond['resource']['code']['text']
+            )
+            self.conditions.setdefault(key,[]).append({
+                'datetime': local_datetime(cond['resource']\
+                    ['onsetDateTime'],cond.get('_utc_offsets',{})\
+                    .get('onsetDateTime')),
+                'condition': cond
+            })
+        for cond_list in self.conditions.values():
+            cond_list.sort(key=lambda z: z['datetime'])
+
+    def find(self,symptom_row,rep=0):
+        patient_id = f"urn:uuid:{symptom_row['PATIENT']}"
+        key = (patient_id,symptom_row['PATHOLOGY'])
+        conditions = self.conditions.get(key,[])
+        patient_birthDate = self.birthDates.get(patient_id)
+        if patient_birthDate is None:
+            conditions = []
+        return select_condition(conditions,patient_birthDate,\
+            symptom_row['AGE_BEGIN'],rep)
+
+def parse_symptoms(symptom_row):
     symptoms = symptom_row['SYMPTOMS']
     if symptom_row['NUM_SYMPTOMS'] > 0:
         symptoms_list_0 = symptoms.split(";")
@@ -93,17 +596,66 @@ def create_symptom_entry(symptom_row,condition):
     for i in range(len(symptoms_list_1)):
         while len(symptoms_list_1[i]) < 3:
             symptoms_list_1[i].append(0)
+    return [
+        {
+            "text": s[0],
+            "severity": symptom_int(s[1]),
+            "duration": symptom_int(s[2])
+        }
+        for s in symptoms_list_1
+    ]
+
+def parse_symptoms_chunk(symptoms_df):
+    """
+    Vectorized parse_symptoms over a chunk of symptoms.csv.
+
+    Returns:
+        list (one item per row) of lists of symptom dicts
+    """
+    has_symptoms = symptoms_df['NUM_SYMPTOMS'] > 0
+    parts = symptoms_df.loc[has_symptoms,'SYMPTOMS'].astype(object)\
+        .str.split(";").explode()
+    fields = parts.str.split(":",expand=True)\
+        .reindex(columns=[0,1,2])
+    fields.columns = ["text","severity","duration"]
+    for column in ["severity","duration"]:
+        values = pd.to_numeric(fields[column],errors="coerce")
+        # NaN and inf compare False, so they become 0 (see symptom_int)
+        fields[column] = values.where(values.abs() < float("inf"),0)\
+            .astype(int)
+    symptoms_lists = {i: [] for i in symptoms_df.index}
+    for i,symptom in zip(fields.index,fields.to_dict('records')):
+        symptoms_lists[i].append(symptom)
+    return [symptoms_lists[i] for i in symptoms_df.index]
+
+def symptom_reps(symptoms_df,last_key=None,last_rep=-1):
+    """
+    Number consecutive rows with the same (PATIENT, PATHOLOGY,
+    AGE_BEGIN): 0 for the first row of a run, 1 for the next, etc.
+    last_key and last_rep describe the last row of the previous chunk
+    so that a run can continue across chunks.
+
+    Returns:
+        numpy array of rep counters
+    """
+    keys = symptoms_df[SYMPTOMS_REP_KEYS]
+    new_run = (keys != keys.shift()).any(axis=1)
+    if len(new_run) > 0:
+        new_run.iloc[0] = (last_key is None) or \
+            (tuple(keys.iloc[0]) != last_key)
+    run_id = new_run.cumsum()
+    reps = keys.groupby(run_id).cumcount().to_numpy(copy=True)
+    if (len(reps) > 0) and (not new_run.iloc[0]):
+        reps[(run_id == 0).to_numpy()] += last_rep + 1
+    return reps
+
+def create_symptom_entry(symptom_row,condition,symptoms=None):
+    if symptoms is None:
+        symptoms = parse_symptoms(symptom_row)
     output_dict = {
         "fullUrl": f"urn:uuid:{uuid.uuid4()}",
         "resource": {
-            "symptoms":[
-                {
-                    "text": s[0],
-                    "severity": s[1],
-                    "duration": s[2]
-                }
-                for s in symptoms_list_1
-            ],
+            "symptoms": symptoms,
             "subject":{
                 "reference": f"urn:uuid:{symptom_row['PATIENT']}"
             },
@@ -127,65 +679,837 @@ def create_symptom_entry(symptom_row,condition):
     }
     return output_dict
 
-def load_symptoms(db_cxn):
-    symptoms_df = pd.read_csv(SYMPTOMS_CSV)
-    patient_id = 'none'
-    pathology = 'none'
-    age = -1
-    rep = 0
-    symptoms = db_cxn['symptoms']
-    for row_index in range(symptoms_df.shape[0]):
-        row = symptoms_df.iloc[row_index]
-        new_patient_id = row['PATIENT']
-        new_pathology = row['PATHOLOGY']
-        new_age = row['AGE_BEGIN']
-        if (new_patient_id == patient_id) and \
-           (new_pathology == pathology) and \
-           (int(new_age) == age):
-            rep += 1
+def load_symptoms(db_cxn,symptoms_csv,batch_size=DEFAULT_BATCH_SIZE,\
+        join="memory",chunksize=SYMPTOMS_CHUNKSIZE,patients=None,\
+        out_db=None):
+    """
+    Load symptoms.csv into the symptoms collection (of out_db, if
+    given, else of db_cxn).  If patients (a collection of Patient
+    fullUrls) is given, only rows for those patients are loaded.
+    """
+    if patients is not None:
+        patient_ids = set([p.replace("urn:uuid:","") for p in patients])
+    if join == "memory":
+        pathologies = set()
+        for chunk in pd.read_csv(symptoms_csv,usecols=['PATHOLOGY'],\
+                chunksize=chunksize):
+            pathologies.update(chunk['PATHOLOGY'].unique())
+        condition_join = ConditionJoin(db_cxn,pathologies,patients)
+    last_key = None
+    last_rep = -1
+    if out_db is None:
+        out_db = db_cxn
+    with BulkWriter(out_db,batch_size) as writer:
+        for chunk in pd.read_csv(symptoms_csv,chunksize=chunksize,\
+                dtype={'PATIENT':str,'SYMPTOMS':str}):
+            if chunk.shape[0] == 0:
+                continue
+            reps = symptom_reps(chunk,last_key,last_rep)
+            last_key = tuple(chunk[SYMPTOMS_REP_KEYS].iloc[-1])
+            last_rep = int(reps[-1])
+            if patients is not None:
+                selected = chunk['PATIENT'].isin(patient_ids).to_numpy()
+                chunk = chunk.loc[selected]
+                reps = reps[selected]
+            symptoms_lists = parse_symptoms_chunk(chunk)
+            rows = chunk.to_dict('records')
+            for row,rep,symptoms in zip(rows,reps,symptoms_lists):
+                if join == "memory":
+                    condition = condition_join.find(row,rep=rep)
+                else:
+                    condition = find_symptoms_condition(db_cxn,row,\
+                        rep=rep)
+                insert_dict = create_symptom_entry(row,condition,\
+                    symptoms)
+                writer.add('symptoms',insert_dict)
+
+
+## Bundle ingestion.  Each worker process holds its own MongoClient,
+## created by the pool initializer after the worker has started.
+
+_worker_client = None
+_worker_db = None
+_worker_batch_size = DEFAULT_BATCH_SIZE
+_worker_profile = None
+_worker_archive_dir = None
+# fullUrl -> file of the last write of each shared resource by this
+# worker
+_worker_seen = {}
+
+def _init_worker(host,port,db_name,batch_size=DEFAULT_BATCH_SIZE,\
+        staging=False,profile="full",archive_dir=None):
+    global _worker_client, _worker_db, _worker_batch_size, \
+        _worker_profile, _worker_archive_dir, _worker_seen
+    _worker_client = pymongo.MongoClient(
+        host,
+        port
+    )
+    _worker_db = _worker_client[db_name]
+    if staging:
+        _worker_db = StagingDatabase(_worker_db)
+    _worker_batch_size = batch_size
+    _worker_profile = PROFILES[profile]
+    _worker_archive_dir = archive_dir
+    _worker_seen = {}
+
+def _close_worker():
+    global _worker_client, _worker_db
+    if _worker_client is not None:
+        _worker_client.close()
+    _worker_client = None
+    _worker_db = None
+
+def load_bundle_file(file_path):
+    """
+    Load every entry of one FHIR bundle file into the collection
+    named by its resourceType.  Runs inside a loader worker.  Each
+    document is tagged with the name of its file (_source), and the
+    file is recorded in the load manifest: as "loading" before the
+    first write and as "loaded" once every entry has been written.
+    With the analytics profile, only projected documents of the
+    profile's resource types are stored.  If an archive directory is
+    set, a compressed copy of the file is written there first.
+    Shared resources (SHARED_RESOURCE_TYPES) are upserted by fullUrl,
+    and are only sent once per file, and in full only once per worker.
+
+    Returns:
+        (Counter of loaded entries by resourceType, list of Patient
+        fullUrls in the bundle, number of shared resources that were
+        already stored)
+    """
+    source = os.path.basename(file_path)
+    manifest = _worker_db[MANIFEST_COLLECTION]
+    record = file_record(file_path)
+    record['sha256'] = file_sha256(file_path)
+    record['status'] = "loading"
+    manifest.replace_one({"_id": source},record,upsert=True)
+    if _worker_archive_dir is not None:
+        archive_bundle(file_path,_worker_archive_dir)
+    counts = Counter()
+    patients = []
+    n_shared = 0
+    with BulkWriter(_worker_db,_worker_batch_size) as writer:
+        for entry in iter_bundle_entries(file_path):
+            resource_type = entry["resource"]["resourceType"]
+            if _worker_profile is not None:
+                if resource_type not in _worker_profile:
+                    continue
+                entry = project_entry(entry,\
+                    _worker_profile[resource_type])
+            counts[resource_type] += 1
+            if resource_type in SHARED_RESOURCE_TYPES:
+                n_shared += 1
+                url = entry["fullUrl"]
+                if _worker_seen.get(url) != source:
+                    writer.upsert(resource_type,url,source,\
+                        None if url in _worker_seen else entry)
+                    _worker_seen[url] = source
+                continue
+            entry["_source"] = source
+            normalize_entry(entry)
+            if resource_type == "Patient":
+                patients.append(entry["fullUrl"])
+            writer.add(resource_type,entry)
+    manifest.update_one(
+        {"_id": source},
+        {"$set": {
+            "status": "loaded",
+            "entries": dict(counts),
+            "loaded_at": datetime.now(timezone.utc)
+        }}
+    )
+    return counts,patients,n_shared - sum(writer.upserted.values())
+
+def try_load_bundle_file(file_path):
+    """
+    load_bundle_file, for files that may be incomplete (watch mode).
+    If the file cannot be parsed, whatever was written from it is
+    removed and it is marked "failed" in the load manifest, so that
+    it can be retried, or picked up by the next incremental run.
+
+    Returns:
+        (file_path, result of load_bundle_file or None, error message
+        or None)
+    """
+    global _worker_seen
+    try:
+        return file_path,load_bundle_file(file_path),None
+    except (ValueError,KeyError) as e:
+        source = os.path.basename(file_path)
+        remove_sources(_worker_db,[source])
+        # Shared resources of this file must be sent again on retry
+        _worker_seen = {url: s for url,s in _worker_seen.items() if \
+            s != source}
+        error = f"{e.__class__.__name__}: {e}"
+        _worker_db[MANIFEST_COLLECTION].update_one(
+            {"_id": source},
+            {"$set": {"status": "failed", "error": error}}
+        )
+        return file_path,None,error
+
+def print_throughput(n_files,counts,elapsed,skipped=0,duplicates=0):
+    elapsed = max(elapsed,1e-9)
+    n_entries = sum(counts.values())
+    print(f"Loaded {n_files} files ({n_entries} entries) in "\
+        f"{elapsed:.1f} s: {n_files/elapsed:.1f} files/s, "\
+        f"{n_entries/elapsed:.1f} entries/s")
+    if skipped > 0:
+        print(f"Skipped {skipped} unchanged files")
+    if duplicates > 0:
+        print(f"Skipped {duplicates} duplicate shared resources "\
+            f"({', '.join(SHARED_RESOURCE_TYPES)})")
+    for resource_type,c in sorted(counts.items(),\
+            key=lambda z: z[1],reverse=True):
+        print(f"    {resource_type}: {c} ({c/elapsed:.1f}/s)")
+
+def load_bundles(files,host,port,db_name,workers=1,\
+        batch_size=DEFAULT_BATCH_SIZE,skipped=0,staging=False,\
+        profile="full",archive_dir=None,retry_failed=False):
+    """
+    Load FHIR bundle files, in parallel when workers > 1, and
+    print a throughput summary.  files may be any iterable of paths
+    (e.g. watch_bundle_files); it is consumed as the workers take
+    files.  With staging=True the files are
+    loaded into the staging collections.  profile names the entry of
+    PROFILES to load with; archive_dir, if given, receives gzip
+    copies of the files.  A file that cannot be parsed stops the load,
+    unless retry_failed is set: then it is put aside and retried once
+    after files is exhausted (for watch_bundle_files, once Synthea has
+    exited), and left marked "failed" in the manifest if it still
+    cannot be parsed.
+
+    Returns:
+        (Counter of loaded entries by resourceType, set of loaded
+        Patient fullUrls)
+    """
+    counts = Counter()
+    patients = set()
+    totals = Counter()
+    failed = []
+    start = time.time()
+
+    def add(file_counts,file_patients,file_duplicates):
+        totals['files'] += 1
+        totals['duplicates'] += file_duplicates
+        counts.update(file_counts)
+        patients.update(file_patients)
+
+    if workers > 1:
+        # spawn, so that no worker inherits a forked MongoClient
+        ctx = multiprocessing.get_context("spawn")
+        pool = ctx.Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(host,port,db_name,batch_size,staging,profile,\
+                archive_dir)
+        )
+        run = lambda file_paths: pool.imap_unordered(\
+            try_load_bundle_file,file_paths)
+    else:
+        pool = None
+        _init_worker(host,port,db_name,batch_size,staging,profile,\
+            archive_dir)
+        run = lambda file_paths: map(try_load_bundle_file,file_paths)
+    try:
+        for file_path,result,error in run(files):
+            if error is None:
+                add(*result)
+            elif retry_failed:
+                print(f"Could not load {file_path} ({error}); it will "\
+                    "be retried")
+                failed.append(file_path)
+            else:
+                raise RuntimeError(f"Could not load {file_path}: {error}")
+        for file_path,result,error in run(failed):
+            if error is None:
+                add(*result)
+            else:
+                print(f"Could not load {file_path} ({error}); it is "\
+                    "marked failed in the load manifest")
+    finally:
+        if pool is not None:
+            pool.terminate()
         else:
-            rep = 0
-        patient_id = new_patient_id
-        pathology = new_pathology
-        age = new_age
-        condition = find_symptoms_condition(db_cxn,row,rep=rep)
-        insert_dict = create_symptom_entry(row,condition)
-        symptoms.insert_one(insert_dict)
+            _close_worker()
+    print_throughput(totals['files'],counts,time.time() - start,\
+        skipped,totals['duplicates'])
+    return counts,patients
 
 
+## Synthea CSV export.  With --format csv the Patient, Encounter, and
+## Condition collections are built from patients.csv, encounters.csv,
+## and conditions.csv instead of the FHIR bundles, in the shape of the
+## FHIR documents (as projected by the analytics profile).
+
+CSV_FILES = ["patients.csv","encounters.csv","conditions.csv"]
+SNOMED_SYSTEM = "http://snomed.info/sct"
+# Synthea encounter classes to the FHIR v3 ActCode codes its FHIR
+# exporter uses
+ENCOUNTER_CLASS_CODES = {
+    "ambulatory": "AMB",
+    "wellness": "AMB",
+    "outpatient": "AMB",
+    "urgentcare": "AMB",
+    "emergency": "EMER",
+    "inpatient": "IMP",
+    "home": "HH",
+    "virtual": "VR"
+}
+
+def csv_datetimes(column):
+    # NaT (missing) becomes None
+    dts = pd.to_datetime(column,utc=True)
+    return [None if pd.isna(d) else d.to_pydatetime() for d in dts]
+
+def csv_codeable_concepts(codes,displays):
+    return [
+        {
+            "coding": [{"system": SNOMED_SYSTEM,"code": c,"display": d}],
+            "text": d
+        } for c,d in zip(codes,displays)
+    ]
+
+def csv_patient_docs(df):
+    """
+    Patient documents from a chunk of patients.csv.
+    """
+    genders = df['GENDER'].map({"M": "male","F": "female"})\
+        .fillna("unknown")
+    return [
+        {
+            "fullUrl": f"urn:uuid:{i}",
+            "resource": {
+                "resourceType": "Patient",
+                "id": i,
+                "birthDate": b,
+                "gender": g
+            }
+        } for i,b,g in zip(df['Id'],df['BIRTHDATE'],genders)
+    ]
+
+def csv_encounter_docs(df):
+    """
+    Encounter documents from a chunk of encounters.csv.
+    """
+    classes = df['ENCOUNTERCLASS'].map(ENCOUNTER_CLASS_CODES)\
+        .fillna(df['ENCOUNTERCLASS'].str.upper())
+    types = csv_codeable_concepts(df['CODE'],df['DESCRIPTION'])
+    has_reason = df['REASONCODE'].notna().to_numpy()
+    reasons = csv_codeable_concepts(df['REASONCODE'],\
+        df['REASONDESCRIPTION'])
+    docs = []
+    for i,row in enumerate(zip(df['Id'],df['PATIENT'],classes,\
+            csv_datetimes(df['START']),csv_datetimes(df['STOP']))):
+        resource = {
+            "resourceType": "Encounter",
+            "id": row[0],
+            "status": "finished",
+            "class": {"code": row[2]},
+            "type": [types[i]],
+            "subject": {"reference": f"urn:uuid:{row[1]}"},
+            "period": {"start": row[3],"end": row[4]}
+        }
+        if has_reason[i]:
+            resource["reasonCode"] = [reasons[i]]
+        docs.append({"fullUrl": f"urn:uuid:{row[0]}","resource": resource})
+    return docs
+
+def csv_condition_docs(df,encounter_starts):
+    """
+    Condition documents from a chunk of conditions.csv.  conditions.csv
+    only has onset dates, so, as in the FHIR export, the onset and
+    recorded datetimes are the start of the diagnosing encounter
+    (encounter_starts, a Series of start datetimes indexed by
+    encounter Id).  Conditions have no Id in the CSV export, so theirs
+    is derived from the patient, encounter, code, and onset date.
+    """
+    starts = df['ENCOUNTER'].map(encounter_starts)
+    starts = starts.where(starts.notna(),pd.to_datetime(df['START'],\
+        utc=True))
+    ids = [str(uuid.uuid5(uuid.NAMESPACE_URL,"/".join(k))) for k in \
+        zip(df['PATIENT'],df['ENCOUNTER'],df['CODE'],df['START'])]
+    codes = csv_codeable_concepts(df['CODE'],df['DESCRIPTION'])
+    onsets = csv_datetimes(starts)
+    abatements = csv_datetimes(df['STOP'])
+    docs = []
+    for i,row in enumerate(zip(ids,df['PATIENT'],df['ENCOUNTER'])):
+        resource = {
+            "resourceType": "Condition",
+            "id": row[0],
+            "code": codes[i],
+            "subject": {"reference": f"urn:uuid:{row[1]}"},
+            "encounter": {"reference": f"urn:uuid:{row[2]}"},
+            "onsetDateTime": onsets[i],
+            "recordedDate": onsets[i]
+        }
+        if abatements[i] is not None:
+            resource["abatementDateTime"] = abatements[i]
+        docs.append({"fullUrl": f"urn:uuid:{row[0]}","resource": resource})
+    return docs
+
+def load_csv_export(db_cxn,csv_dir,batch_size=DEFAULT_BATCH_SIZE,\
+        chunksize=SYMPTOMS_CHUNKSIZE):
+    """
+    Load patients.csv, encounters.csv, and conditions.csv of a Synthea
+    CSV export into the Patient, Encounter, and Condition collections,
+    recording each file in the load manifest, and print a throughput
+    summary.
+
+    Returns:
+        Counter of loaded documents by resourceType
+    """
+    manifest = db_cxn[MANIFEST_COLLECTION]
+    counts = Counter()
+    start = time.time()
+    encounter_starts = pd.Series(dtype=object)
+    readers = [
+        ("patients.csv","Patient",csv_patient_docs),
+        ("encounters.csv","Encounter",csv_encounter_docs),
+        ("conditions.csv","Condition",lambda df: csv_condition_docs(\
+            df,encounter_starts))
+    ]
+    with BulkWriter(db_cxn,batch_size) as writer:
+        for file_name,resource_type,make_docs in readers:
+            file_path = os.path.join(csv_dir,file_name)
+            record = file_record(file_path)
+            record.update({"sha256": file_sha256(file_path),\
+                "status": "loading","kind": "csv"})
+            manifest.replace_one({"_id": file_name},record,upsert=True)
+            starts = []
+            for chunk in pd.read_csv(file_path,chunksize=chunksize,\
+                    dtype=str):
+                if resource_type == "Encounter":
+                    starts.append(pd.to_datetime(chunk['START'],\
+                        utc=True).set_axis(chunk['Id']))
+                for doc in make_docs(chunk):
+                    doc["_source"] = file_name
+                    writer.add(resource_type,doc)
+                    counts[resource_type] += 1
+            if resource_type == "Encounter" and len(starts) > 0:
+                encounter_starts = pd.concat(starts)
+            writer.flush()
+            manifest.update_one(
+                {"_id": file_name},
+                {"$set": {
+                    "status": "loaded",
+                    "entries": {resource_type: counts[resource_type]},
+                    "loaded_at": datetime.now(timezone.utc)
+                }}
+            )
+    print_throughput(len(CSV_FILES),counts,time.time() - start)
+    return counts
+
+
+## Watch mode.  Bundles are loaded while Synthea is still writing
+## them: a file is queued once it has stopped growing.
+
+def process_running(pid):
+    """
+    True if process pid exists and has not exited (a zombie that its
+    parent has not reaped yet counts as exited).
+    """
+    try:
+        os.kill(pid,0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            state = f.read().rsplit(")",1)[1].split()[0]
+        return state != "Z"
+    except (OSError,IndexError):
+        return True
+
+def watch_bundle_files(data_dir,synthea_pid=None,settle=WATCH_SETTLE,\
+        idle_timeout=WATCH_IDLE_TIMEOUT,poll=WATCH_POLL_INTERVAL):
+    """
+    Yield the files of data_dir as they are completed.  A file is
+    complete once its size and mtime have not changed for settle
+    seconds, or once the Synthea process has exited.  Stops when
+    process synthea_pid has exited and every file has been yielded;
+    without a pid, when no file has appeared or changed for
+    idle_timeout seconds.
+    """
+    seen = {}
+    done = set()
+    last_change = time.time()
+    while True:
+        finished = (synthea_pid is not None) and \
+            (not process_running(synthea_pid))
+        now = time.time()
+        names = sorted(os.listdir(data_dir)) \
+            if os.path.isdir(data_dir) else []
+        pending = 0
+        for name in names:
+            file_path = os.path.join(data_dir,name)
+            if file_path in done:
+                continue
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            key = (stat.st_size,stat.st_mtime_ns)
+            if (file_path not in seen) or (seen[file_path][0] != key):
+                seen[file_path] = (key,now)
+                last_change = now
+                pending += 1
+            elif finished or (now - seen[file_path][1] >= settle):
+                done.add(file_path)
+                yield file_path
+            else:
+                pending += 1
+        if pending == 0:
+            if finished:
+                return
+            if (synthea_pid is None) and \
+                    (now - last_change >= idle_timeout):
+                return
+        time.sleep(poll)
+
+def new_or_changed_files(db_cxn,files,removed_patients):
+    """
+    Filter an iterable of bundle files (for incremental watch mode)
+    down to those not loaded yet.  Documents of changed or interrupted
+    files are removed first, and the fullUrls of their Patients are
+    added to removed_patients.
+    """
+    manifest = db_cxn[MANIFEST_COLLECTION]
+    for file_path in files:
+        source = os.path.basename(file_path)
+        record = manifest.find_one({"_id": source})
+        if file_unchanged(file_path,record,manifest):
+            continue
+        if record is not None:
+            removed_patients.update(remove_sources(db_cxn,[source]))
+        yield file_path
+
+
+## Load manifest.  One document per loaded file (keyed by file name)
+## records its size, mtime, content hash, and load status, so that a
+## re-run only loads new, changed, or interrupted files.
+
+def file_sha256(file_path,chunk_size=PARSE_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(file_path,'rb') as f:
+        for block in iter(lambda: f.read(chunk_size),b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_record(file_path):
+    stat = os.stat(file_path)
+    return {
+        "path": os.path.abspath(file_path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns
+    }
+
+def file_unchanged(file_path,record,manifest=None):
+    """
+    True if file_path was completely loaded and has not changed since.
+    The content hash is only computed when size or mtime differ; if
+    only the mtime changed, the new mtime is written to the manifest
+    (when given) so that the file is not hashed again next time.
+    """
+    if (record is None) or (record.get('status') != "loaded"):
+        return False
+    current = file_record(file_path)
+    if current['size'] != record['size']:
+        return False
+    if current['mtime'] == record['mtime']:
+        return True
+    if file_sha256(file_path) != record['sha256']:
+        return False
+    if manifest is not None:
+        manifest.update_one({"_id": record['_id']},\
+            {"$set": {"mtime": current['mtime']}})
+    return True
+
+def remove_sources(db_cxn,sources,batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Delete every document loaded from the given bundle files.  Shared
+    resources are only deleted once no remaining file contains them.
+
+    Returns:
+        set of fullUrls of the removed Patients
+    """
+    patients = set()
+    sources = list(sources)
+    collections = [c for c in db_cxn.list_collection_names() if \
+        c not in (MANIFEST_COLLECTION,"symptoms")]
+    for i in range(0,len(sources),batch_size):
+        query = {"_source": {"$in": sources[i:i+batch_size]}}
+        patients.update([p['fullUrl'] for p in \
+            db_cxn.Patient.find(query,{"_id":0,"fullUrl":1})])
+        for collection in collections:
+            if collection in SHARED_RESOURCE_TYPES:
+                db_cxn[collection].update_many(query,{"$pull": \
+                    {"_source": {"$in": sources[i:i+batch_size]}}})
+                db_cxn[collection].delete_many({"_source": {"$size": 0}})
+            else:
+                db_cxn[collection].delete_many(query)
+    return patients
+
+def plan_incremental_load(db_cxn,files):
+    """
+    Compare bundle files with the load manifest.  Documents from
+    changed, interrupted, and deleted files are removed so that the
+    files can be (re)loaded cleanly.
+
+    Returns:
+        (list of files to load, number of unchanged files skipped,
+        set of fullUrls of removed Patients)
+    """
+    manifest = db_cxn[MANIFEST_COLLECTION]
+    records = {r['_id']: r for r in manifest.find({})}
+    to_load = []
+    stale = []
+    skipped = 0
+    sources = set()
+    for file_path in files:
+        source = os.path.basename(file_path)
+        sources.add(source)
+        record = records.get(source)
+        if file_unchanged(file_path,record,manifest):
+            skipped += 1
+            continue
+        if record is not None:
+            stale.append(source)
+        to_load.append(file_path)
+    removed = [r for r in records if (r not in sources) and \
+        (records[r].get('kind') != "symptoms")]
+    patients = remove_sources(db_cxn,stale + removed)
+    if len(removed) > 0:
+        manifest.delete_many({"_id": {"$in": removed}})
+    print(f"{len(to_load)} bundle files to load ({len(stale)} changed "\
+        f"or interrupted), {skipped} unchanged, {len(removed)} removed")
+    return to_load,skipped,patients
+
+def sync_symptoms(db_cxn,symptoms_csv,changed_patients=None,\
+        full=False,**kwargs):
+    """
+    Bring the symptoms collection up to date with symptoms.csv.
+    A new, interrupted, or (otherwise) modified symptoms.csv is
+    reloaded in full; in a live database that reload goes through a
+    staging collection.  Symptoms rows follow their patient's bundle,
+    so if only bundles have changed, only the rows of the changed
+    patients are reloaded.  Otherwise the symptoms are skipped.
+
+    Returns:
+        bool, True if the symptoms collection was changed
+    """
+    manifest = db_cxn[MANIFEST_COLLECTION]
+    source = os.path.basename(symptoms_csv)
+    record = manifest.find_one({"_id": source})
+    sha256 = file_sha256(symptoms_csv)
+    csv_changed = (record is None) or \
+        (record.get('status') != "loaded") or \
+        (record.get('sha256') != sha256)
+    changed_patients = changed_patients or set()
+    if (not full) and (not csv_changed) and \
+        (len(changed_patients) == 0):
+        print(f"{source} unchanged; skipping symptoms")
+        return False
+    new_record = file_record(symptoms_csv)
+    new_record.update({"sha256": sha256, "status": "loading",\
+        "kind": "symptoms"})
+    manifest.replace_one({"_id": source},new_record,upsert=True)
+    start = time.time()
+    if full or csv_changed:
+        if isinstance(db_cxn,StagingDatabase):
+            db_cxn.symptoms.delete_many({})
+            load_symptoms(db_cxn,symptoms_csv,**kwargs)
+        else:
+            staging = StagingDatabase(db_cxn)
+            staging.symptoms.drop()
+            load_symptoms(db_cxn,symptoms_csv,out_db=staging,**kwargs)
+            build_indexes(staging,["symptoms"])
+            swap_staging(db_cxn,["symptoms"])
+    else:
+        patients = list(changed_patients)
+        for i in range(0,len(patients),DEFAULT_BATCH_SIZE):
+            db_cxn.symptoms.delete_many({"resource.subject.reference":\
+                {"$in": patients[i:i+DEFAULT_BATCH_SIZE]}})
+        load_symptoms(db_cxn,symptoms_csv,patients=changed_patients,\
+            **kwargs)
+    manifest.update_one(
+        {"_id": source},
+        {"$set": {
+            "status": "loaded",
+            "loaded_at": datetime.now(timezone.utc)
+        }}
+    )
+    print(f"Loaded symptoms in {time.time() - start:.1f} s")
+    return True
+
+def build_indexes(db_cxn,collections=None):
+    """
+    Build the indexes declared in indexes.py and report their build
+    times and sizes.
+    """
+    report = indexes.create_indexes(db_cxn,collections)
+    sizes = indexes.index_sizes(db_cxn,collections)
+    indexes.print_index_report(report,sizes)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load Synthea FHIR bundles and symptoms into mongo."
+    )
+    parser.add_argument("--full",action="store_true",
+        help="delete all collections and reload every file, instead "\
+            "of loading only new and changed files")
+    parser.add_argument("--workers",type=int,\
+        default=os.cpu_count() or 1,
+        help="number of bundle loader processes (default: all cores)")
+    parser.add_argument("--host",default="localhost",
+        help="mongo host (default: localhost)")
+    parser.add_argument("--port",type=int,default=27017,
+        help="mongo port (default: 27017)")
+    parser.add_argument("--db",default="symptoms_db",
+        help="mongo database name (default: symptoms_db)")
+    parser.add_argument("--batch-size",type=int,\
+        default=DEFAULT_BATCH_SIZE,
+        help="documents per insert_many call, per collection "\
+            f"(default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--symptoms-join",choices=["memory","query"],\
+        default="memory",
+        help="match symptoms rows to conditions with an in-memory "\
+            "join (default) or with per-row queries")
+    parser.add_argument("--symptoms-chunksize",type=int,\
+        default=SYMPTOMS_CHUNKSIZE,
+        help="symptoms.csv rows processed at a time "\
+            f"(default: {SYMPTOMS_CHUNKSIZE})")
+    parser.add_argument("--profile",choices=list(PROFILES.keys()),\
+        default="full",
+        help="store every resource in full (default), or only the "\
+            "fields the application reads (analytics)")
+    parser.add_argument("--archive-dir",
+        help="write a gzip compressed copy of every loaded bundle to "\
+            "this directory")
+    parser.add_argument("--watch",action="store_true",
+        help="load bundles while Synthea is still writing them, then "\
+            "load the symptoms once it has finished")
+    parser.add_argument("--synthea-pid",type=int,
+        help="with --watch, stop watching when this process exits")
+    parser.add_argument("--watch-settle",type=float,\
+        default=WATCH_SETTLE,
+        help="with --watch, seconds a file must stop changing before "\
+            f"it is loaded (default: {WATCH_SETTLE:g})")
+    parser.add_argument("--watch-idle",type=float,\
+        default=WATCH_IDLE_TIMEOUT,
+        help="with --watch and no --synthea-pid, stop after this many "\
+            f"seconds without new files (default: {WATCH_IDLE_TIMEOUT:g})")
+    parser.add_argument("--format",choices=["fhir","csv"],\
+        default="fhir",
+        help="load Synthea's FHIR bundles (default) or its CSV export "\
+            "(patients, encounters, and conditions only; always a full "\
+            "reload)")
+    args = parser.parse_args(argv)
+    if (args.format == "csv") and args.watch:
+        parser.error("--watch only applies to --format fhir")
+    return args
+
 
 if __name__ == "__main__":
+    args = parse_args()
     client = pymongo.MongoClient(
-        "localhost",
-        27017
+        args.host,
+        args.port
     )
 
-    db = client.symptoms_db
+    db = client[args.db]
     PROJECT_ROOT = os.environ.get('PROJECT_ROOT') or "../"
     DATA_DIR = os.path.join(PROJECT_ROOT,"data",\
         "synthea_output","fhir")
+    CSV_DIR = os.path.join(PROJECT_ROOT,"data",\
+        "synthea_output","csv")
     SYMPTOMS_CSV = os.path.join(PROJECT_ROOT,"data",\
         "synthea_output","symptoms","csv","symptoms.csv")
-    if os.path.exists(DATA_DIR):
-        FILES = os.listdir(DATA_DIR)
-        collection_names = db.list_collection_names()
-        for collection in collection_names:
-            records = db[collection]
-            c = records.count_documents({})
-            print(f"Removing {c} {collection}s")
-            records.delete_many({})
-            print(f"All {collection}s deleted.")
-            c = records.count_documents({})
-            print(f"{c} {collection}s remaining")
-        for file in FILES:
-            with open(os.path.join(DATA_DIR,file),'r') as f:
-                json_record = json.load(f)
-                for entry in json_record['entry']:
-                    records = db[entry["resource"]["resourceType"]]
-                    record_id = records.insert_one(entry)
+    # Without a manifest there is no record of what is loaded, so
+    # start from scratch.
+    full = args.full or \
+        (MANIFEST_COLLECTION not in db.list_collection_names())
+    # Changing profile needs a full reload, since the loaded documents
+    # have the other profile's shape.
+    live = db[GENERATION_COLLECTION].find_one({"_id": "live"}) or {}
+    profile = "csv" if args.format == "csv" else args.profile
+    if (not full) and (args.format == "csv"):
+        print("The CSV export is always reloaded in full")
+        full = True
+    if (not full) and (live.get("profile","full") != profile):
+        print(f"Profile changed from {live.get('profile','full')} to "\
+            f"{profile}, reloading everything")
+        full = True
+    if args.archive_dir is not None:
+        os.makedirs(args.archive_dir,exist_ok=True)
+    # A full reload is built in staging collections (left over ones
+    # from an interrupted run are dropped first) and swapped in at the
+    # end; incremental loads write to the live collections.
+    if full:
+        target = StagingDatabase(db)
+        target.drop()
+    else:
+        target = db
+    # Shared resources are de-duplicated on their unique fullUrl index
+    build_indexes(target,SHARED_RESOURCE_TYPES)
+
+    changed_patients = set()
+    bundles_changed = False
+    loader_kwargs = dict(workers=args.workers,batch_size=args.batch_size,\
+        staging=full,profile=args.profile,archive_dir=args.archive_dir)
+    if args.format == "csv":
+        counts = load_csv_export(target,CSV_DIR,batch_size=args.batch_size,\
+            chunksize=args.symptoms_chunksize)
+        bundles_changed = True
+    elif args.watch:
+        # Load bundles as Synthea writes them.  Incremental runs still
+        # check each file against the manifest, and the full pass
+        # below then only removes the documents of deleted bundles.
+        files = watch_bundle_files(DATA_DIR,args.synthea_pid,\
+            settle=args.watch_settle,idle_timeout=args.watch_idle)
+        if not full:
+            files = new_or_changed_files(db,files,changed_patients)
+        counts,loaded_patients = load_bundles(files,args.host,\
+            args.port,args.db,retry_failed=True,**loader_kwargs)
+        changed_patients |= loaded_patients
+        bundles_changed = (sum(counts.values()) > 0)
+    if os.path.exists(DATA_DIR) and (args.format == "fhir") and \
+            not (args.watch and full):
+        FILES = [os.path.join(DATA_DIR,file) for file in \
+            os.listdir(DATA_DIR)]
+        if full:
+            to_load,skipped,removed_patients = FILES,0,set()
+        else:
+            to_load,skipped,removed_patients = \
+                plan_incremental_load(db,FILES)
+        if (len(to_load) > 0) or (not args.watch):
+            counts,loaded_patients = load_bundles(to_load,args.host,\
+                args.port,args.db,skipped=skipped,**loader_kwargs)
+            changed_patients |= loaded_patients
+        changed_patients |= removed_patients
+        bundles_changed = bundles_changed or (len(to_load) > 0)
 
+    # load_symptoms looks up Patients and Conditions
+    build_indexes(target,["Patient","Condition"])
+
+    symptoms_changed = False
     if os.path.exists(SYMPTOMS_CSV):
-        load_symptoms(db)
+        symptoms_changed = sync_symptoms(target,SYMPTOMS_CSV,\
+            changed_patients,full=full,batch_size=args.batch_size,\
+            join=args.symptoms_join,chunksize=args.symptoms_chunksize)
 
-    client.close()
+    build_indexes(target,["Encounter","DiagnosticReport","symptoms"])
+    # The other resource types indexed on _source (for remove_sources)
+    loaded = target.list_collection_names()
+    build_indexes(target,[c for c in ["Observation","Claim",\
+        "ExplanationOfBenefit"] if c in loaded])
 
+    if full:
+        record_generation(db,swap_staging(db),profile)
+    elif bundles_changed or (len(changed_patients) > 0) or \
+        symptoms_changed:
+        record_generation(db,[c for c in db.list_collection_names() \
+            if not c.startswith("_")],profile)
+
+    client.close()